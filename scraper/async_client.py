@@ -3,44 +3,148 @@ Async GraphQL client for parallel StandVirtual API requests
 """
 import asyncio
 import aiohttp
+import heapq
 import logging
-from typing import Optional
-
+import random
+from contextlib import aclosing
+from typing import AsyncIterator, Awaitable, Callable, Optional, Sequence
+
+# Prefer orjson for decoding the multi-KB GraphQL responses
+try:
+    import orjson as json_lib
+except ImportError:
+    import json as json_lib
+
+from listing_parser import extract_listings
+from rate_limiter import AdaptiveRateLimiter, get_rate_limit_delay
 from config import (
     GRAPHQL_ENDPOINT,
     HEADERS,
     MAX_RETRIES,
-    get_request_body,
+    get_request_body_bytes,
 )
 
 logger = logging.getLogger(__name__)
 
 # Concurrency settings
 CONCURRENT_REQUESTS = 10  # Tested safe at this level
-BATCH_SIZE = 50  # Process in batches to manage memory
+CONCURRENCY_INCREASE_AFTER = 20  # Consecutive successes before allowing one more request in flight
+PAGE_RETRIES = 3  # Extra attempts for a page that came back with an error
+PAGE_RETRY_MAX_DELAY = 60  # Cap on the per-page retry backoff, in seconds
+# Connection pool size of the shared session. Fixed rather than taken from the
+# first client, since every client on the loop shares the pool; each client's
+# adaptive budget decides how many of these it actually uses
+MAX_CONNECTIONS = 100
+
+
+# One session (and connection pool) per process, so repeated scrapes on the
+# same event loop reuse open connections instead of paying TCP+TLS setup again
+_session: Optional[aiohttp.ClientSession] = None
+_session_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+async def _get_session() -> aiohttp.ClientSession:
+    """Return the shared session, creating it on first use"""
+    global _session, _session_loop
+    loop = asyncio.get_running_loop()
+    # A session can't outlive the loop it was created on (each asyncio.run()
+    # starts a new one), so rebuild it when the loop changes
+    if _session is None or _session.closed or _session_loop is not loop:
+        # Every request goes to the same host: cache its DNS entry for the whole
+        # run and keep idle connections open long enough to be reused
+        connector = aiohttp.TCPConnector(
+            limit=MAX_CONNECTIONS,
+            limit_per_host=MAX_CONNECTIONS,
+            ttl_dns_cache=600,
+            keepalive_timeout=75,
+        )
+        _session = aiohttp.ClientSession(
+            headers=HEADERS,
+            connector=connector,
+            auto_decompress=True,
+            # Increased from 30s to 60s; fail fast if a connection can't be opened
+            timeout=aiohttp.ClientTimeout(total=60, connect=10),
+        )
+        _session_loop = loop
+    return _session
+
+
+async def close_session():
+    """Close the shared session; call once before the event loop shuts down"""
+    global _session, _session_loop
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+    _session_loop = None
 
 
 class AsyncGraphQLClient:
     """Async client for parallel StandVirtual API requests"""
 
-    def __init__(self, concurrency: int = CONCURRENT_REQUESTS):
+    def __init__(
+        self,
+        concurrency: int = CONCURRENT_REQUESTS,
+        rate_limiter: Optional[AdaptiveRateLimiter] = None,
+        max_concurrency: Optional[int] = None,
+    ):
         self.concurrency = concurrency
+        self.max_concurrency = max(concurrency, max_concurrency or concurrency)
+        self.rate_limiter = rate_limiter
         self.session: Optional[aiohttp.ClientSession] = None
-        self._semaphore: Optional[asyncio.Semaphore] = None
+
+        # AIMD gate: `_budget` is how many requests may be in flight right now.
+        # It starts at `concurrency`, is halved when the server pushes back and
+        # grows by one after a run of successes, up to `max_concurrency`.
+        self._budget = concurrency
+        self._in_flight = 0
+        self._successes = 0
+        self._generation = 0
+        self._slots: Optional[asyncio.Condition] = None
 
     async def __aenter__(self):
-        connector = aiohttp.TCPConnector(limit=self.concurrency)
-        self.session = aiohttp.ClientSession(
-            headers=HEADERS,
-            connector=connector,
-            timeout=aiohttp.ClientTimeout(total=60)  # Increased from 30s to 60s
-        )
-        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._slots = asyncio.Condition()
+        self.session = await _get_session()
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        if self.session:
-            await self.session.close()
+        # The shared session stays open for the next client, see close_session()
+        self.session = None
+
+    async def _acquire_slot(self) -> int:
+        """Wait until the current budget allows another request in flight.
+
+        Returns:
+            The budget generation the request started in
+        """
+        async with self._slots:
+            while self._in_flight >= self._budget:
+                await self._slots.wait()
+            self._in_flight += 1
+            return self._generation
+
+    async def _release_slot(self):
+        async with self._slots:
+            self._in_flight -= 1
+            self._slots.notify_all()
+
+    def _on_success(self):
+        if self.rate_limiter:
+            self.rate_limiter.on_success()
+        self._successes += 1
+        if self._successes >= CONCURRENCY_INCREASE_AFTER and self._budget < self.max_concurrency:
+            self._budget += 1
+            self._successes = 0
+            logger.debug(f"Concurrency raised to {self._budget}")
+
+    def _on_overload(self, generation: int):
+        self._successes = 0
+        # Requests already in flight when the budget was cut belong to the same
+        # burst; only the first of them may cut again
+        if generation != self._generation or self._budget == 1:
+            return
+        self._generation += 1
+        self._budget = max(1, self._budget // 2)
+        logger.warning(f"Server overloaded, concurrency cut to {self._budget}")
 
     async def fetch_page(self, page: int, retries: int = MAX_RETRIES) -> dict:
         """
@@ -49,69 +153,167 @@ class AsyncGraphQLClient:
         Returns:
             Dict with 'page', 'data' or 'error' keys
         """
-        async with self._semaphore:
-            for attempt in range(retries):
-                try:
-                    async with self.session.post(
-                        GRAPHQL_ENDPOINT,
-                        json=get_request_body(page)
-                    ) as response:
-                        if response.status == 429:
-                            # Rate limited - wait and retry
-                            wait_time = 2 ** attempt
-                            logger.warning(f"Rate limited on page {page}, waiting {wait_time}s")
-                            await asyncio.sleep(wait_time)
-                            continue
-
-                        if response.status != 200:
-                            logger.error(f"HTTP {response.status} on page {page}")
-                            return {"page": page, "error": f"HTTP {response.status}"}
-
-                        data = await response.json()
-
-                        if "errors" in data:
-                            error_msg = data["errors"][0].get("message", "Unknown")
-                            logger.error(f"GraphQL error on page {page}: {error_msg}")
-                            return {"page": page, "error": error_msg}
-
+        for attempt in range(retries):
+            if self.rate_limiter:
+                await self.rate_limiter.throttle()
+            generation = await self._acquire_slot()
+            try:
+                async with self.session.post(
+                    GRAPHQL_ENDPOINT,
+                    data=get_request_body_bytes(page)
+                ) as response:
+                    if response.status == 429:
+                        # Rate limited - wait as long as the server asks, then retry
+                        self._on_overload(generation)
+                        if self.rate_limiter:
+                            self.rate_limiter.on_rate_limit()
+                        wait_time = get_rate_limit_delay(response.headers.get("Retry-After"), attempt)
+                        logger.warning(f"Rate limited on page {page}, waiting {wait_time:.1f}s")
+                    elif response.status != 200:
+                        if response.status >= 500:
+                            self._on_overload(generation)
+                            if self.rate_limiter:
+                                self.rate_limiter.on_error()
+                        logger.error(f"HTTP {response.status} on page {page}")
+                        return {"page": page, "error": f"HTTP {response.status}"}
+                    else:
+                        if page == 1:
+                            # aiohttp decompresses transparently; log what the server actually sent
+                            logger.debug(f"Content-Encoding: {response.headers.get('Content-Encoding', 'identity')}")
+                        data = json_lib.loads(await response.read())
+
+                        # Succeed first: only look for GraphQL errors when the payload is missing
+                        try:
+                            data["data"]["advertSearch"]
+                        except (KeyError, TypeError):
+                            errors = data.get("errors")
+                            if errors:
+                                error_msg = errors[0].get("message", "Unknown")
+                                logger.error(f"GraphQL error on page {page}: {error_msg}")
+                                return {"page": page, "error": error_msg}
+
+                        self._on_success()
                         return {"page": page, "data": data}
 
-                except asyncio.TimeoutError:
-                    logger.warning(f"Timeout on page {page}, attempt {attempt + 1}")
-                    await asyncio.sleep(1)
+            except asyncio.TimeoutError:
+                logger.warning(f"Timeout on page {page}, attempt {attempt + 1}")
+                if self.rate_limiter:
+                    self.rate_limiter.on_error()
+                wait_time = 1
+            except Exception as e:
+                logger.error(f"Error on page {page}: {e}")
+                return {"page": page, "error": str(e)}
+            finally:
+                await self._release_slot()
+
+            # Back off without holding a slot
+            await asyncio.sleep(wait_time)
+
+        return {"page": page, "error": "Max retries exceeded"}
+
+    async def fetch_pages_stream(self, pages: Sequence[int], retries: int = 0) -> AsyncIterator[dict]:
+        """
+        Fetch multiple pages in parallel, yielding each result as soon as it lands.
+
+        A pool of `max_concurrency` workers pulls pages from a shared iterator, so
+        a slow page never holds back the rest. How many of them actually have a
+        request in flight is governed by the adaptive budget. At most
+        `max_concurrency` finished results wait for the caller, so memory stays
+        proportional to the concurrency rather than the page count.
+
+        A page that fails is put back with its own exponential backoff (up to
+        `retries` times) and picked up again by whichever worker is free once
+        it is due, so retries never hit the server all at once.
+
+        Args:
+            pages: Page numbers to fetch; a range is consumed lazily
+            retries: How many times to retry a page that returned an error
+
+        Yields:
+            One final result per page in completion order, each with 'page' and
+            'data' or 'error'
+        """
+        total = len(pages)
+        results: asyncio.Queue = asyncio.Queue(maxsize=self.max_concurrency)
+        # Workers share one iterator, so page numbers are only produced as they
+        # are picked up (next() can't be interleaved on a single event loop)
+        page_iter = iter(pages)
+        # Failed pages waiting for another attempt: (due time, page, attempts so far)
+        retry_heap: list[tuple[float, int, int]] = []
+        loop = asyncio.get_running_loop()
+
+        async def worker():
+            while True:
+                if retry_heap and retry_heap[0][0] <= loop.time():
+                    _, page, attempt = heapq.heappop(retry_heap)
+                else:
+                    page = next(page_iter, None)
+                    attempt = 0
+                    if page is None:
+                        if not retry_heap:
+                            return
+                        await asyncio.sleep(retry_heap[0][0] - loop.time())
+                        continue
+
+                try:
+                    result = await self.fetch_page(page)
                 except Exception as e:
-                    logger.error(f"Error on page {page}: {e}")
-                    return {"page": page, "error": str(e)}
+                    result = {"page": page, "error": str(e)}
 
-            return {"page": page, "error": "Max retries exceeded"}
+                if "error" in result and attempt < retries:
+                    delay = min(PAGE_RETRY_MAX_DELAY, 2 ** (attempt + 1)) + random.uniform(0, 1)
+                    logger.info(f"Page {page} failed ({result['error']}), retrying in {delay:.1f}s")
+                    heapq.heappush(retry_heap, (loop.time() + delay, page, attempt + 1))
+                    continue
+                await results.put(result)
 
-    async def fetch_pages(self, pages: list[int], progress_callback=None) -> list[dict]:
+        workers = [asyncio.create_task(worker()) for _ in range(min(self.max_concurrency, total))]
+        try:
+            for _ in range(total):
+                yield await results.get()
+        finally:
+            for task in workers:
+                task.cancel()
+
+    async def fetch_pages(
+        self,
+        pages: Sequence[int],
+        consumer: Callable[[int, list[dict]], Awaitable[None]],
+        progress_callback=None,
+        retries: int = 0,
+    ) -> list[dict]:
         """
-        Fetch multiple pages in parallel.
+        Fetch multiple pages in parallel, handing each page's listings to `consumer`.
+
+        Each response is parsed and passed on as soon as it arrives and then
+        dropped; see fetch_pages_stream().
 
         Args:
-            pages: List of page numbers to fetch
+            pages: Page numbers to fetch; a range is consumed lazily
+            consumer: Coroutine function called as consumer(page, listings)
             progress_callback: Optional callback(completed, total) for progress updates
+            retries: How many times to retry a page that returned an error
 
         Returns:
-            List of results, each with 'page' and 'data' or 'error'
+            List of results that still failed after all retries, each with 'page' and 'error'
         """
-        results = []
-        total = len(pages)
+        failed = []
         completed = 0
+        total = len(pages)
 
-        # Process in batches to manage memory
-        for i in range(0, total, BATCH_SIZE):
-            batch = pages[i:i + BATCH_SIZE]
-            tasks = [self.fetch_page(page) for page in batch]
-            batch_results = await asyncio.gather(*tasks)
-            results.extend(batch_results)
+        async with aclosing(self.fetch_pages_stream(pages, retries)) as stream:
+            async for result in stream:
+                if "error" in result:
+                    failed.append(result)
+                else:
+                    await consumer(result["page"], self.extract_listings(result["data"]))
+                del result
 
-            completed += len(batch)
-            if progress_callback:
-                progress_callback(completed, total)
+                completed += 1
+                if progress_callback:
+                    progress_callback(completed, total)
 
-        return results
+        return failed
 
     def extract_listings(self, response: dict) -> list[dict]:
         """Extract listing data from API response."""
@@ -121,92 +323,7 @@ class AsyncGraphQLClient:
             logger.error("Unexpected response structure")
             return []
 
-        listings = []
-        for edge in edges:
-            node = edge.get("node", {})
-            if not node:
-                continue
-
-            listing = self._parse_listing(node)
-            if listing:
-                listings.append(listing)
-
-        return listings
-
-    def _parse_listing(self, node: dict) -> Optional[dict]:
-        """Parse a single listing node into our schema format"""
-        try:
-            # Extract price
-            price_data = node.get("price", {})
-            price_amount = price_data.get("amount", {})
-            price = price_amount.get("units", 0)
-
-            # Extract price evaluation
-            price_eval = node.get("priceEvaluation", {})
-            price_evaluation = price_eval.get("indicator") if price_eval else None
-
-            # Extract location
-            location = node.get("location", {})
-            city = location.get("city", {}).get("name") if location.get("city") else None
-            region = location.get("region", {}).get("name") if location.get("region") else None
-
-            # Extract seller info
-            seller_link = node.get("sellerLink", {})
-            seller_name = seller_link.get("name") if seller_link else None
-            seller_type = node.get("sellerType")
-
-            # Extract thumbnail
-            thumbnail = node.get("thumbnail", {})
-            thumbnail_url = thumbnail.get("x1") if thumbnail else None
-
-            # Extract badges (can be list of strings or objects)
-            badges = node.get("badges", [])
-            if badges and isinstance(badges[0], str):
-                badges_list = badges
-            else:
-                badges_list = [b.get("type") for b in badges if b and b.get("type")] if badges else []
-
-            # Extract parameters
-            params = {p["key"]: p["value"] for p in node.get("parameters", []) if p.get("key")}
-
-            # Parse createdAt timestamp from API
-            created_at_str = node.get("createdAt")
-            listing_date = None
-            if created_at_str:
-                try:
-                    from datetime import datetime
-                    # Parse ISO format: "2025-12-12T22:50:46Z"
-                    dt = datetime.fromisoformat(created_at_str.replace("Z", "+00:00"))
-                    listing_date = int(dt.timestamp())
-                except (ValueError, AttributeError):
-                    pass
-
-            return {
-                "id": str(node.get("id")),
-                "title": node.get("title", ""),
-                "url": node.get("url", ""),
-                "price": price,
-                "price_evaluation": price_evaluation,
-                "make": params.get("make", ""),
-                "model": params.get("model", ""),
-                "version": params.get("version"),
-                "year": int(params.get("first_registration_year", 0)) if params.get("first_registration_year") else None,
-                "mileage": int(params.get("mileage", 0)) if params.get("mileage") else None,
-                "fuel_type": params.get("fuel_type"),
-                "gearbox": params.get("gearbox"),
-                "engine_capacity": int(params.get("engine_capacity", 0)) if params.get("engine_capacity") else None,
-                "engine_power": int(params.get("engine_power", 0)) if params.get("engine_power") else None,
-                "city": city,
-                "region": region,
-                "seller_name": seller_name,
-                "seller_type": seller_type,
-                "thumbnail_url": thumbnail_url,
-                "badges": badges_list,
-                "listing_date": listing_date,
-            }
-        except Exception as e:
-            logger.error(f"Error parsing listing: {e}")
-            return None
+        return extract_listings(edges)
 
     def get_total_pages(self, response: dict) -> int:
         """Extract total page count from response"""
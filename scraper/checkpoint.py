@@ -1,17 +1,29 @@
 """
 Checkpoint management for resume capability
 """
-import json
+import os
+import asyncio
+import tempfile
 import time
 import logging
 from pathlib import Path
 from typing import Optional
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, asdict, field
 
-from config import CHECKPOINT_PATH
+# orjson serializes straight to bytes
+try:
+    import orjson as json_lib
+except ImportError:
+    import json as json_lib
+
+from config import CHECKPOINT_FLUSH_SECONDS, CHECKPOINT_PATH, CHECKPOINT_SAVE_INTERVAL
 
 logger = logging.getLogger(__name__)
 
+# Process umask, read once: new checkpoint files get the mode open() would give them
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
 
 @dataclass
 class Checkpoint:
@@ -23,6 +35,10 @@ class Checkpoint:
     listings_updated: int
     timestamp: float
     status: str  # running, completed, failed
+    started_at: float = 0.0
+    # Pages finished beyond `last_page` (async mode completes pages out of order);
+    # everything up to and including `last_page` is done
+    completed_pages: list[int] = field(default_factory=list)
 
     def to_dict(self) -> dict:
         return asdict(self)
@@ -35,17 +51,102 @@ class Checkpoint:
 class CheckpointManager:
     """Manages saving and loading scrape checkpoints"""
 
-    def __init__(self, path: Path = CHECKPOINT_PATH):
+    def __init__(self, path: Path = CHECKPOINT_PATH, save_interval: int = CHECKPOINT_SAVE_INTERVAL):
         self.path = path
+        self.save_interval = save_interval
+        self._updates_since_save = 0
+
+        # Background writer used by async scrapers, see start()
+        self._writer_task: Optional[asyncio.Task] = None
+        self._pending: Optional[asyncio.Event] = None
+        # Serialized on the event loop, so the writer thread never reads a
+        # checkpoint the loop is still changing
+        self._latest: Optional[bytes] = None
+        self._stopping = False
+
+    async def start(self):
+        """Persist updates from a background task instead of on the event loop"""
+        if self._writer_task:
+            return
+        self._pending = asyncio.Event()
+        self._stopping = False
+        self._writer_task = asyncio.create_task(self._writer_loop())
+
+    async def stop(self):
+        """Stop the background writer and flush the latest update"""
+        if not self._writer_task:
+            return
+        self._stopping = True
+        self._pending.set()
+        await self._writer_task
+        self._writer_task = None
+
+        if self._latest is not None:
+            await asyncio.to_thread(self._write, self._latest)
+            self._latest = None
+
+    async def _writer_loop(self):
+        # Only the latest state matters, so updates arriving while a write is in
+        # flight or during the pause are coalesced into the next write
+        while not self._stopping:
+            await self._pending.wait()
+            self._pending.clear()
+            if self._stopping:
+                return
+            latest, self._latest = self._latest, None
+            if latest is not None:
+                await asyncio.to_thread(self._write, latest)
+            await asyncio.sleep(CHECKPOINT_FLUSH_SECONDS)
 
     def save(self, checkpoint: Checkpoint):
         """Save checkpoint to file"""
-        try:
-            with open(self.path, "w") as f:
-                json.dump(checkpoint.to_dict(), f, indent=2)
+        if self._write(self._encode(checkpoint)):
+            self._updates_since_save = 0
             logger.debug(f"Checkpoint saved: page {checkpoint.last_page}/{checkpoint.total_pages}")
+
+    @staticmethod
+    def _encode(checkpoint: Checkpoint) -> bytes:
+        data = json_lib.dumps(checkpoint.to_dict())
+        if isinstance(data, str):
+            data = data.encode()
+        return data
+
+    def _write(self, data: bytes) -> bool:
+        """
+        Atomically replace the checkpoint file with `data`.
+
+        The data is written to a temp file and fsynced before being renamed over
+        the old checkpoint, so a crash leaves either the old or the new one.
+        Each write gets its own temp file, so a direct save() and the background
+        writer can never rename each other's half-written data into place.
+        """
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(
+                dir=self.path.parent, prefix=f"{self.path.name}.", suffix=".tmp"
+            )
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            # mkstemp creates the file 0600; keep the checkpoint's usual mode
+            try:
+                mode = self.path.stat().st_mode & 0o777
+            except FileNotFoundError:
+                mode = 0o666 & ~_UMASK
+            os.chmod(tmp_path, mode)
+            os.replace(tmp_path, self.path)
+            tmp_path = None
+            return True
         except Exception as e:
             logger.error(f"Failed to save checkpoint: {e}")
+            return False
+        finally:
+            if tmp_path is not None:
+                try:
+                    os.unlink(tmp_path)
+                except OSError:
+                    pass
 
     def load(self) -> Optional[Checkpoint]:
         """Load checkpoint from file"""
@@ -53,8 +154,7 @@ class CheckpointManager:
             return None
 
         try:
-            with open(self.path, "r") as f:
-                data = json.load(f)
+            data = json_lib.loads(self.path.read_bytes())
             checkpoint = Checkpoint.from_dict(data)
 
             # Check if checkpoint is stale (older than 24 hours)
@@ -88,7 +188,8 @@ class CheckpointManager:
             listings_new=0,
             listings_updated=0,
             timestamp=time.time(),
-            status="running"
+            status="running",
+            started_at=time.time(),
         )
         self.save(checkpoint)
         return checkpoint
@@ -101,15 +202,51 @@ class CheckpointManager:
         updated_listings: int = 0,
         found_listings: int = 0,
     ) -> Checkpoint:
-        """Update checkpoint with progress"""
+        """
+        Update checkpoint with progress.
+
+        Saves every `save_interval` updates, or hands the checkpoint to the
+        background writer if one is running.
+        """
         checkpoint.last_page = page
         checkpoint.listings_found += found_listings
         checkpoint.listings_new += new_listings
         checkpoint.listings_updated += updated_listings
         checkpoint.timestamp = time.time()
-        self.save(checkpoint)
+
+        if self._writer_task:
+            self._latest = self._encode(checkpoint)
+            self._pending.set()
+            return checkpoint
+
+        self._updates_since_save += 1
+        if self._updates_since_save >= self.save_interval:
+            self.save(checkpoint)
         return checkpoint
 
+    def complete_pages(
+        self,
+        checkpoint: Checkpoint,
+        pages: list[int],
+        new_listings: int = 0,
+        updated_listings: int = 0,
+        found_listings: int = 0,
+    ) -> Checkpoint:
+        """Record pages finished in any order, advancing `last_page` over the contiguous prefix"""
+        done = set(checkpoint.completed_pages)
+        done.update(pages)
+        last_page = checkpoint.last_page
+        while last_page + 1 in done:
+            last_page += 1
+        checkpoint.completed_pages = sorted(page for page in done if page > last_page)
+        return self.update(
+            checkpoint,
+            page=last_page,
+            new_listings=new_listings,
+            updated_listings=updated_listings,
+            found_listings=found_listings,
+        )
+
     def mark_completed(self, checkpoint: Checkpoint) -> Checkpoint:
         """Mark checkpoint as completed"""
         checkpoint.status = "completed"
@@ -2,21 +2,32 @@
 GraphQL client for StandVirtual API
 """
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from tenacity import (
     retry,
     stop_after_attempt,
     wait_exponential,
     retry_if_exception_type,
 )
-from typing import Optional
 import logging
+from typing import Optional
+
+# Prefer orjson for decoding the multi-KB GraphQL responses
+try:
+    import orjson as json_lib
+except ImportError:
+    import json as json_lib
 
+from listing_parser import extract_listings
+from rate_limiter import parse_retry_after
 from config import (
     GRAPHQL_ENDPOINT,
     HEADERS,
     MAX_RETRIES,
+    MAX_RETRY_AFTER_SECONDS,
     RETRY_BACKOFF_MULTIPLIER,
-    get_request_body,
+    get_request_body_bytes,
 )
 
 logger = logging.getLogger(__name__)
@@ -24,7 +35,21 @@ logger = logging.getLogger(__name__)
 
 class RateLimitError(Exception):
     """Raised when API returns 429 rate limit"""
-    pass
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+_exponential_wait = wait_exponential(multiplier=RETRY_BACKOFF_MULTIPLIER, min=4, max=60)
+
+
+def _wait_for_retry(retry_state) -> float:
+    """Wait what the server asked for on 429s, otherwise back off exponentially"""
+    error = retry_state.outcome.exception()
+    if isinstance(error, RateLimitError) and error.retry_after is not None:
+        return min(MAX_RETRY_AFTER_SECONDS, error.retry_after)
+    return _exponential_wait(retry_state)
 
 
 class GraphQLClient:
@@ -34,9 +59,19 @@ class GraphQLClient:
         self.session = requests.Session()
         self.session.headers.update(HEADERS)
 
+        # Pages are fetched one at a time from a single host, so one keep-alive
+        # connection is reused throughout. Failures to (re)connect are retried
+        # quickly here; everything after the request is sent is left to tenacity.
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=1,
+            max_retries=Retry(total=3, connect=3, read=0, status=0, backoff_factor=0.3),
+        )
+        self.session.mount("https://", adapter)
+
     @retry(
         stop=stop_after_attempt(MAX_RETRIES),
-        wait=wait_exponential(multiplier=RETRY_BACKOFF_MULTIPLIER, min=4, max=60),
+        wait=_wait_for_retry,
         retry=retry_if_exception_type((requests.RequestException, RateLimitError)),
         before_sleep=lambda retry_state: logger.warning(
             f"Retry attempt {retry_state.attempt_number} after error"
@@ -56,27 +91,39 @@ class GraphQLClient:
             RateLimitError: If rate limited (429)
             requests.RequestException: For other HTTP errors
         """
-        body = get_request_body(page)
-
         response = self.session.post(
             GRAPHQL_ENDPOINT,
-            json=body,
+            data=get_request_body_bytes(page),
             timeout=30
         )
 
         if response.status_code == 429:
             logger.warning(f"Rate limited on page {page}")
-            raise RateLimitError("Rate limited by API")
+            raise RateLimitError(
+                "Rate limited by API",
+                retry_after=parse_retry_after(response.headers.get("Retry-After")),
+            )
 
         response.raise_for_status()
 
-        data = response.json()
+        if page == 1:
+            # requests decompresses transparently; log what the server actually sent
+            logger.debug(f"Content-Encoding: {response.headers.get('Content-Encoding', 'identity')}")
+
+        try:
+            data = json_lib.loads(response.content)
+        except ValueError as e:
+            raise requests.RequestException(f"Invalid JSON response: {e}")
 
-        # Check for GraphQL errors
-        if "errors" in data:
-            error_msg = data["errors"][0].get("message", "Unknown GraphQL error")
-            logger.error(f"GraphQL error: {error_msg}")
-            raise requests.RequestException(f"GraphQL error: {error_msg}")
+        # Succeed first: only look for GraphQL errors when the payload is missing
+        try:
+            data["data"]["listingScreen"]
+        except (KeyError, TypeError):
+            errors = data.get("errors")
+            if errors:
+                error_msg = errors[0].get("message", "Unknown GraphQL error")
+                logger.error(f"GraphQL error: {error_msg}")
+                raise requests.RequestException(f"GraphQL error: {error_msg}")
 
         return data
 
@@ -96,78 +143,7 @@ class GraphQLClient:
             logger.error("Unexpected response structure")
             return []
 
-        listings = []
-
-        for edge in ads:
-            node = edge.get("node", {})
-            if not node:
-                continue
-
-            # Parse listing data
-            listing = self._parse_listing(node)
-            if listing:
-                listings.append(listing)
-
-        return listings
-
-    def _parse_listing(self, node: dict) -> Optional[dict]:
-        """Parse a single listing node into our schema format"""
-        try:
-            # Extract price
-            price_data = node.get("price", {})
-            price_amount = price_data.get("amount", {})
-            price = price_amount.get("units", 0)
-
-            # Extract price evaluation
-            price_eval = node.get("priceEvaluation", {})
-            price_evaluation = price_eval.get("indicator") if price_eval else None
-
-            # Extract location
-            location = node.get("location", {})
-            city = location.get("city", {}).get("name") if location.get("city") else None
-            region = location.get("region", {}).get("name") if location.get("region") else None
-
-            # Extract seller info
-            seller_link = node.get("sellerLink", {})
-            seller_name = seller_link.get("name") if seller_link else None
-            seller_type = node.get("sellerType")
-
-            # Extract thumbnail
-            thumbnail = node.get("thumbnail", {})
-            thumbnail_url = thumbnail.get("x1") if thumbnail else None
-
-            # Extract badges
-            badges = node.get("badges", [])
-            badges_list = [b.get("type") for b in badges if b.get("type")] if badges else []
-
-            # Extract parameters
-            params = {p["key"]: p["value"] for p in node.get("parameters", []) if p.get("key")}
-
-            return {
-                "id": str(node.get("id")),
-                "title": node.get("title", ""),
-                "url": node.get("url", ""),
-                "price": price,
-                "price_evaluation": price_evaluation,
-                "make": params.get("make", ""),
-                "model": params.get("model", ""),
-                "version": params.get("version"),
-                "year": int(params.get("first_registration_year", 0)) if params.get("first_registration_year") else None,
-                "mileage": int(params.get("mileage", 0)) if params.get("mileage") else None,
-                "fuel_type": params.get("fuel_type"),
-                "gearbox": params.get("gearbox"),
-                "engine_capacity": int(params.get("engine_capacity", 0)) if params.get("engine_capacity") else None,
-                "engine_power": int(params.get("engine_power", 0)) if params.get("engine_power") else None,
-                "city": city,
-                "region": region,
-                "seller_name": seller_name,
-                "seller_type": seller_type,
-                "thumbnail_url": thumbnail_url,
-                "badges": badges_list,
-            }
-        except Exception as e:
-            logger.error(f"Error parsing listing: {e}")
-            return None
+        return extract_listings(ads)
 
     def get_total_pages(self, response: dict) -> int:
         """Extract total page count from response"""
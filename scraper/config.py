@@ -2,6 +2,7 @@
 Configuration for StandVirtual scraper
 """
 import os
+import json
 from pathlib import Path
 
 # API Configuration
@@ -20,12 +21,15 @@ MIN_DELAY_SECONDS = 0.1    # Minimal delay for safety
 MAX_DELAY_SECONDS = 0.3
 MAX_RETRIES = 8  # Increased from 5 to 8 for better recovery
 RETRY_BACKOFF_MULTIPLIER = 2.0
+MAX_RETRY_AFTER_SECONDS = 30  # Cap on server-advised (Retry-After) waits
 
 # Paths
 SCRAPER_DIR = Path(__file__).parent
 DATA_DIR = SCRAPER_DIR / "data"
 DATABASE_PATH = DATA_DIR / "listings.db"
 CHECKPOINT_PATH = DATA_DIR / "checkpoint.json"
+CHECKPOINT_SAVE_INTERVAL = 10  # Pages between checkpoint writes
+CHECKPOINT_FLUSH_SECONDS = 0.5  # Minimum gap between background checkpoint writes
 
 # Ensure data directory exists
 DATA_DIR.mkdir(exist_ok=True)
@@ -34,60 +38,108 @@ DATA_DIR.mkdir(exist_ok=True)
 DATABASE_URL = os.environ.get("DATABASE_URL")
 USE_POSTGRES = bool(DATABASE_URL)
 
+# Pooled connections kept open to PostgreSQL; every scrape does its database
+# work on one thread, so a handful is plenty
+PG_POOL_MAX_CONNECTIONS = 4
+
+# Rows per upsert statement/transaction; keeps statements well under
+# PostgreSQL's 65535 bind-parameter limit and commits progress as it goes
+UPSERT_BATCH_SIZE = 500
+
+# Rows deactivated per transaction when marking unseen listings inactive
+MARK_INACTIVE_BATCH_SIZE = 10000
+
+# Sequential scraper: refresh the scrape_runs row every N pages or T seconds
+SCRAPE_RUN_UPDATE_PAGES = 10
+SCRAPE_RUN_UPDATE_SECONDS = 30
+# Parallel scraper: saves land every few seconds, so refresh at most this often
+PARALLEL_SCRAPE_RUN_UPDATE_SECONDS = 5
+
 # Request Headers (mimic browser)
+# Compressed responses are several times smaller; only advertise brotli when a
+# decoder is installed, since both requests and aiohttp rely on it for "br"
+try:
+    import brotli  # noqa: F401
+    ACCEPT_ENCODING = "gzip, br"
+except ImportError:
+    ACCEPT_ENCODING = "gzip"
+
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
     "Accept": "application/json",
     "Accept-Language": "pt-PT,pt;q=0.9,en;q=0.8",
+    "Accept-Encoding": ACCEPT_ENCODING,
     "Content-Type": "application/json",
     "Origin": "https://www.standvirtual.com",
     "Referer": "https://www.standvirtual.com/carros",
 }
 
 # GraphQL Query Variables Template
+# Everything except the page number is fixed, so build it once and only
+# swap the page in per request (nested lists are shared, not copied)
+_QUERY_VARIABLES = {
+    "page": 1,
+    "filters": [{"name": "category_id", "value": "29"}],  # Cars category
+    "parameters": [
+        "make",
+        "model",
+        "version",
+        "fuel_type",
+        "gearbox",
+        "mileage",
+        "engine_capacity",
+        "engine_power",
+        "first_registration_year"
+    ],
+    "includePriceEvaluation": True,
+    "includeFilters": False,
+    "includeFiltersCounters": False,
+    "includeSuggestedFilters": False,
+    "includeNewSearch": False,
+    "includeSortOptions": False,
+    "includeRatings": False,
+    "includePromotedAds": False,
+    "includeNewPromotedAds": False,
+    "includeClick2Buy": False,
+    "includeTopAds": False,
+    "includeCepik": False,
+    "promotedInput": {
+        "filter": []
+    },
+}
+
+_REQUEST_BODY = {
+    "operationName": "listingScreen",
+    "variables": _QUERY_VARIABLES,
+    "extensions": {
+        "persistedQuery": {
+            "sha256Hash": PERSISTED_QUERY_HASH,
+            "version": 1
+        }
+    }
+}
+
+
 def get_query_variables(page: int) -> dict:
     """Generate GraphQL variables for a specific page"""
-    return {
-        "page": page,
-        "filters": [{"name": "category_id", "value": "29"}],  # Cars category
-        "parameters": [
-            "make",
-            "model",
-            "version",
-            "fuel_type",
-            "gearbox",
-            "mileage",
-            "engine_capacity",
-            "engine_power",
-            "first_registration_year"
-        ],
-        "includePriceEvaluation": True,
-        "includeFilters": False,
-        "includeFiltersCounters": False,
-        "includeSuggestedFilters": False,
-        "includeNewSearch": False,
-        "includeSortOptions": False,
-        "includeRatings": False,
-        "includePromotedAds": False,
-        "includeNewPromotedAds": False,
-        "includeClick2Buy": False,
-        "includeTopAds": False,
-        "includeCepik": False,
-        "promotedInput": {
-            "filter": []
-        },
-    }
+    return {**_QUERY_VARIABLES, "page": page}
+
 
 # GraphQL Request Body Template
 def get_request_body(page: int) -> dict:
     """Generate full GraphQL request body for a page"""
-    return {
-        "operationName": "listingScreen",
-        "variables": get_query_variables(page),
-        "extensions": {
-            "persistedQuery": {
-                "sha256Hash": PERSISTED_QUERY_HASH,
-                "version": 1
-            }
-        }
-    }
+    return {**_REQUEST_BODY, "variables": get_query_variables(page)}
+
+
+# Pre-serialized request body - only the page number changes between requests,
+# so encode the body once and splice the page in as bytes
+_PAGE_PLACEHOLDER = "__PAGE__"
+_BODY_TEMPLATE = json.dumps(
+    get_request_body(_PAGE_PLACEHOLDER),
+    separators=(",", ":"),
+).encode().replace(f'"{_PAGE_PLACEHOLDER}"'.encode(), b"%d")
+
+
+def get_request_body_bytes(page: int) -> bytes:
+    """Get the JSON-encoded GraphQL request body for a page"""
+    return _BODY_TEMPLATE % page
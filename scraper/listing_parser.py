@@ -0,0 +1,219 @@
+"""
+Listing node parsing shared by the sync and async GraphQL clients
+
+Plain Python, annotated so it compiles cleanly with mypyc for the
+~45k listings parsed per full scrape:
+
+    pip install mypy
+    mypyc listing_parser.py
+
+The compiled extension module is imported in place of this file when it
+is present; otherwise this file is used as-is.
+"""
+import logging
+from datetime import datetime
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+# One shared copy of each low-cardinality value ("BMW", "Diesel", "Lisboa")
+# instead of a fresh string per listing; stays at a few thousand entries
+_interned: dict[str, str] = {}
+
+
+def _intern(value: Optional[str]) -> Optional[str]:
+    """Return the cached copy of a repeated string field"""
+    if value is None:
+        return None
+    return _interned.setdefault(value, value)
+
+
+def parse_timestamp(value: str) -> Optional[int]:
+    """
+    Convert an API timestamp like "2025-12-12T22:50:46Z" to Unix seconds.
+
+    datetime.fromisoformat is C code and beats hand-rolled slicing or
+    calendar.timegm; on Python 3.11+ it also takes the trailing "Z" as-is,
+    so the string only gets rewritten on older interpreters.
+    """
+    try:
+        try:
+            dt = datetime.fromisoformat(value)
+        except ValueError:
+            dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        return int(dt.timestamp())
+    except (ValueError, AttributeError, TypeError):
+        return None
+
+
+def extract_listings(edges: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    """Parse the listing nodes of a page of search result edges"""
+    parse = parse_listing
+    return [
+        listing
+        for listing in (parse(node) for node in (edge.get("node") for edge in edges) if node)
+        if listing
+    ]
+
+
+def parse_listing(node: dict[str, Any]) -> Optional[dict[str, Any]]:
+    """
+    Parse a single listing node into our schema format.
+
+    GraphQL returns every requested field (null when empty), so the
+    common case subscripts directly and only null-checks the optional
+    objects. Nodes with an unexpected shape go through the tolerant
+    .get() based parser instead.
+    """
+    try:
+        price = node["price"]["amount"]["units"]
+
+        price_eval = node["priceEvaluation"]
+        price_evaluation = price_eval["indicator"] if price_eval else None
+
+        location = node["location"]
+        city = location["city"]
+        city = city["name"] if city else None
+        region = location["region"]
+        region = region["name"] if region else None
+
+        seller_link = node["sellerLink"]
+        seller_name = seller_link["name"] if seller_link else None
+
+        thumbnail = node["thumbnail"]
+        thumbnail_url = thumbnail["x1"] if thumbnail else None
+
+        # Badges can be a list of strings or objects
+        badges = node["badges"]
+        if not badges:
+            badges_list = []
+        elif isinstance(badges[0], str):
+            badges_list = badges
+        else:
+            badges_list = [b["type"] for b in badges if b and b["type"]]
+
+        # Pick out the parameters we store in one pass instead of building a dict
+        make = model = ""
+        version = fuel_type = gearbox = None
+        year = mileage = engine_capacity = engine_power = None
+        for p in node["parameters"]:
+            key = p["key"]
+            if key == "make":
+                make = p["value"]
+            elif key == "model":
+                model = p["value"]
+            elif key == "version":
+                version = p["value"]
+            elif key == "fuel_type":
+                fuel_type = p["value"]
+            elif key == "gearbox":
+                gearbox = p["value"]
+            elif key == "first_registration_year":
+                year = p["value"]
+            elif key == "mileage":
+                mileage = p["value"]
+            elif key == "engine_capacity":
+                engine_capacity = p["value"]
+            elif key == "engine_power":
+                engine_power = p["value"]
+    except (KeyError, TypeError, IndexError):
+        return parse_listing_safe(node)
+
+    try:
+        created_at_str = node.get("createdAt")
+        listing_date = parse_timestamp(created_at_str) if created_at_str else None
+
+        return {
+            "id": str(node.get("id")),
+            "title": node.get("title", ""),
+            "url": node.get("url", ""),
+            "price": price,
+            "price_evaluation": _intern(price_evaluation),
+            "make": _intern(make),
+            "model": _intern(model),
+            "version": version,
+            "year": int(year) if year else None,
+            "mileage": int(mileage) if mileage else None,
+            "fuel_type": _intern(fuel_type),
+            "gearbox": _intern(gearbox),
+            "engine_capacity": int(engine_capacity) if engine_capacity else None,
+            "engine_power": int(engine_power) if engine_power else None,
+            "city": _intern(city),
+            "region": _intern(region),
+            "seller_name": seller_name,
+            "seller_type": _intern(node.get("sellerType")),
+            "thumbnail_url": thumbnail_url,
+            "badges": badges_list,
+            "listing_date": listing_date,
+        }
+    except Exception as e:
+        logger.error(f"Error parsing listing: {e}")
+        return None
+
+
+def parse_listing_safe(node: dict[str, Any]) -> Optional[dict[str, Any]]:
+    """Parse a listing node that may be missing fields"""
+    try:
+        # Extract price
+        price_data = node.get("price", {})
+        price_amount = price_data.get("amount", {})
+        price = price_amount.get("units", 0)
+
+        # Extract price evaluation
+        price_eval = node.get("priceEvaluation", {})
+        price_evaluation = price_eval.get("indicator") if price_eval else None
+
+        # Extract location
+        location = node.get("location", {})
+        city = location.get("city", {}).get("name") if location.get("city") else None
+        region = location.get("region", {}).get("name") if location.get("region") else None
+
+        # Extract seller info
+        seller_link = node.get("sellerLink", {})
+        seller_name = seller_link.get("name") if seller_link else None
+        seller_type = node.get("sellerType")
+
+        # Extract thumbnail
+        thumbnail = node.get("thumbnail", {})
+        thumbnail_url = thumbnail.get("x1") if thumbnail else None
+
+        # Extract badges (can be list of strings or objects)
+        badges = node.get("badges", [])
+        if badges and isinstance(badges[0], str):
+            badges_list = badges
+        else:
+            badges_list = [b.get("type") for b in badges if b and b.get("type")] if badges else []
+
+        # Extract parameters
+        params = {p["key"]: p["value"] for p in node.get("parameters", []) if p.get("key")}
+
+        # Parse createdAt timestamp from API
+        created_at_str = node.get("createdAt")
+        listing_date = parse_timestamp(created_at_str) if created_at_str else None
+
+        return {
+            "id": str(node.get("id")),
+            "title": node.get("title", ""),
+            "url": node.get("url", ""),
+            "price": price,
+            "price_evaluation": _intern(price_evaluation),
+            "make": _intern(params.get("make", "")),
+            "model": _intern(params.get("model", "")),
+            "version": params.get("version"),
+            "year": int(params.get("first_registration_year", 0)) if params.get("first_registration_year") else None,
+            "mileage": int(params.get("mileage", 0)) if params.get("mileage") else None,
+            "fuel_type": _intern(params.get("fuel_type")),
+            "gearbox": _intern(params.get("gearbox")),
+            "engine_capacity": int(params.get("engine_capacity", 0)) if params.get("engine_capacity") else None,
+            "engine_power": int(params.get("engine_power", 0)) if params.get("engine_power") else None,
+            "city": _intern(city),
+            "region": _intern(region),
+            "seller_name": seller_name,
+            "seller_type": _intern(seller_type),
+            "thumbnail_url": thumbnail_url,
+            "badges": badges_list,
+            "listing_date": listing_date,
+        }
+    except Exception as e:
+        logger.error(f"Error parsing listing: {e}")
+        return None
@@ -9,12 +9,19 @@ import time
 import logging
 import argparse
 import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
-from pathlib import Path
 
-from config import MAX_PAGES
+from config import (
+    MAX_PAGES,
+    PARALLEL_SCRAPE_RUN_UPDATE_SECONDS,
+    SCRAPE_RUN_UPDATE_PAGES,
+    SCRAPE_RUN_UPDATE_SECONDS,
+    UPSERT_BATCH_SIZE,
+)
 from client import GraphQLClient, RateLimitError
-from async_client import AsyncGraphQLClient
+from async_client import PAGE_RETRIES, AsyncGraphQLClient, close_session
 from rate_limiter import AdaptiveRateLimiter
 from checkpoint import CheckpointManager, Checkpoint
 from storage import Storage
@@ -60,6 +67,9 @@ class Scraper:
         # Create scrape run record
         run_id = self.storage.create_scrape_run()
         scrape_start_time = int(time.time())
+        if checkpoint and checkpoint.started_at:
+            # Listings seen before the interruption still count for this scrape
+            scrape_start_time = int(checkpoint.started_at)
 
         try:
             # Get total pages from first request
@@ -91,6 +101,7 @@ class Scraper:
             logger.info(f"Page 1/{total_pages}: {len(listings)} listings ({new_count} new, {updated_count} updated)")
 
             # Process remaining pages
+            last_run_update = time.monotonic()
             for page in range(max(2, start_page), total_pages + 1):
                 try:
                     self.rate_limiter.wait()
@@ -111,14 +122,16 @@ class Scraper:
                     )
                     self.rate_limiter.on_success()
 
-                    # Update scrape run
-                    self.storage.update_scrape_run(
-                        run_id,
-                        pages_scraped=page,
-                        listings_found=checkpoint.listings_found,
-                        listings_new=checkpoint.listings_new,
-                        listings_updated=checkpoint.listings_updated,
-                    )
+                    # Update scrape run (throttled; the final stats are written after the loop)
+                    if page % SCRAPE_RUN_UPDATE_PAGES == 0 or time.monotonic() - last_run_update > SCRAPE_RUN_UPDATE_SECONDS:
+                        self.storage.update_scrape_run(
+                            run_id,
+                            pages_scraped=page,
+                            listings_found=checkpoint.listings_found,
+                            listings_new=checkpoint.listings_new,
+                            listings_updated=checkpoint.listings_updated,
+                        )
+                        last_run_update = time.monotonic()
 
                     # Progress logging every 10 pages
                     if page % 10 == 0:
@@ -199,35 +212,96 @@ class Scraper:
 
         finally:
             self.client.close()
+            self.storage.close()
 
 
 class AsyncScraper:
     """Async scraper for parallel requests - much faster than sequential"""
 
-    def __init__(self, max_pages: Optional[int] = None, concurrency: int = 10):
+    def __init__(
+        self,
+        max_pages: Optional[int] = None,
+        concurrency: int = 10,
+        max_concurrency: Optional[int] = None,
+    ):
         self.checkpoint_manager = CheckpointManager()
         self.storage = Storage()
         self.max_pages = max_pages or MAX_PAGES
         self.concurrency = concurrency
+        # Concurrency may grow up to this while the server keeps up
+        self.max_concurrency = max_concurrency or concurrency
+        self.rate_limiter = AdaptiveRateLimiter()
+        # One thread for all database work: the event loop never blocks on a
+        # commit, writes stay serialized, and the default executor is left free.
+        # Created per run() and shut down when it ends
+        self._db_executor: Optional[ThreadPoolExecutor] = None
+
+    async def _db(self, func, *args, **kwargs):
+        """Run a blocking Storage call on the database thread"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._db_executor, functools.partial(func, *args, **kwargs))
+
+    @staticmethod
+    async def _created_run_id(run_id_task: asyncio.Future) -> Optional[int]:
+        """The scrape run id for error handlers, or None if creating the run failed"""
+        if run_id_task.cancelled():
+            return None
+        try:
+            return await asyncio.shield(run_id_task)
+        except Exception as e:
+            logger.error(f"Could not create scrape run: {e}")
+            return None
 
-    async def run(self) -> dict:
+    async def run(self, resume: bool = True) -> dict:
         """
         Run the async parallel scraper.
 
+        Args:
+            resume: Whether to skip pages an interrupted run already saved
+
         Returns:
             Summary statistics
         """
         logger.info(f"Starting async scraper with {self.concurrency} concurrent connections...")
-        start_time = time.time()
+        # Durations only; monotonic so clock adjustments can't skew the rate
+        start_time = time.monotonic()
 
-        # Create scrape run record
-        run_id = self.storage.create_scrape_run()
+        # Create scrape run record while the first page is in flight
+        self._db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+        run_id_task = asyncio.ensure_future(self._db(self.storage.create_scrape_run))
         scrape_start_time = int(time.time())
+        checkpoint: Optional[Checkpoint] = None
+        speculative: dict[int, asyncio.Future] = {}
+
+        if resume:
+            checkpoint = self.checkpoint_manager.load()
+
+        # Everything up to last_page plus the out-of-order extras is saved
+        completed = set()
+        if checkpoint:
+            completed = set(range(1, checkpoint.last_page + 1))
+            completed.update(checkpoint.completed_pages)
 
         try:
-            async with AsyncGraphQLClient(concurrency=self.concurrency) as client:
+            async with AsyncGraphQLClient(
+                concurrency=self.concurrency,
+                rate_limiter=self.rate_limiter,
+                max_concurrency=self.max_concurrency,
+            ) as client:
+                # The page count is only known once page 1 arrives; fetch the next
+                # few pages alongside it instead of waiting a full round trip
+                speculative_last = min(self.max_pages, self.concurrency)
+                speculative = {
+                    page: asyncio.ensure_future(client.fetch_page(page))
+                    for page in range(2, speculative_last + 1)
+                    if page not in completed
+                }
+
                 # Get total pages from first request
                 first_result = await client.fetch_page(1)
+                # Shielded: an interrupt here must not cancel the run's creation,
+                # or the row would be left 'running' with no one to close it
+                run_id = await asyncio.shield(run_id_task)
 
                 if "error" in first_result:
                     raise Exception(f"Failed to fetch first page: {first_result['error']}")
@@ -239,126 +313,184 @@ class AsyncScraper:
                 expected_listings = total_pages * 32  # PAGE_SIZE = 32
                 logger.info(f"Found {total_count:,} listings across {total_pages} pages (expecting ~{expected_listings:,} from pagination)")
 
-                # Process first page
-                listings = client.extract_listings(first_response)
-                new_count, updated_count = self.storage.upsert_listings(listings)
-                total_new = new_count
-                total_updated = updated_count
-                total_found = len(listings)
-
-                logger.info(f"Page 1: {len(listings)} listings ({new_count} new)")
+                # Speculative pages past the real end are not needed
+                for page, task in list(speculative.items()):
+                    if page > total_pages:
+                        task.cancel()
+                        del speculative[page]
+
+                if checkpoint:
+                    if checkpoint.started_at:
+                        scrape_start_time = int(checkpoint.started_at)
+                    total_new = checkpoint.listings_new
+                    total_updated = checkpoint.listings_updated
+                    total_found = checkpoint.listings_found
+                    logger.info(f"Resuming: {len(completed)} pages already saved")
+                else:
+                    checkpoint = self.checkpoint_manager.create_initial(total_pages)
+                    total_new = total_updated = total_found = 0
+
+                # Progress for the status API, written off the event loop
+                await self.checkpoint_manager.start()
 
                 # Fetch remaining pages in parallel
-                remaining_pages = list(range(2, total_pages + 1))
+                remaining_pages = range(max(2, speculative_last + 1), total_pages + 1)
+                if completed:
+                    remaining_pages = [page for page in remaining_pages if page not in completed]
                 failed_pages = []  # Initialize here so it's always defined
 
-                if remaining_pages:
-                    # Write progress to checkpoint file for status API
-                    progress_file = Path(__file__).parent / "data" / "checkpoint.json"
-                    progress_file.parent.mkdir(parents=True, exist_ok=True)
-
-                    def progress_callback(completed, total):
-                        # Write progress to file every 10 pages for real-time UI updates
-                        if completed % 10 == 0 or completed == total:
-                            import json as json_module
-                            progress_data = {
-                                "last_page": completed + 1,  # +1 because we already processed page 1
-                                "total_pages": total + 1,
-                                "listings_found": total_found + (completed * 32),  # Estimate
-                                "status": "running"
-                            }
-                            progress_file.write_text(json_module.dumps(progress_data))
-
-                        if completed % 100 == 0 or completed == total:
-                            elapsed = time.time() - start_time
-                            rate = completed / elapsed * 60 if elapsed > 0 else 0
-                            remaining = (total - completed) / rate if rate > 0 else 0
-                            logger.info(
-                                f"Progress: {completed}/{total} pages "
-                                f"({rate:.0f} pages/min, ~{remaining:.1f} min remaining)"
-                            )
-
-                    logger.info(f"Fetching {len(remaining_pages)} pages in parallel...")
-                    results = await client.fetch_pages(remaining_pages, progress_callback)
-
-                    # Process results and collect failed pages for retry
-                    logger.info("Processing results and saving in batches...")
-                    batch_listings = []
-                    batch_size = 1000  # Save every 1000 listings
-                    failed_pages = []
-
-                    for i, result in enumerate(results):
-                        if "error" in result:
-                            failed_pages.append(result["page"])
-                            logger.warning(f"Page {result['page']} failed: {result['error']}")
-                            continue
-
-                        page_listings = client.extract_listings(result["data"])
-                        if page_listings:
-                            batch_listings.extend(page_listings)
-
-                        # Save batch when we have enough listings
-                        if len(batch_listings) >= batch_size:
-                            logger.info(f"Saving batch of {len(batch_listings)} listings...")
-                            save_start = time.time()
-                            new_count, updated_count = self.storage.upsert_listings(batch_listings)
-                            save_elapsed = time.time() - save_start
-                            logger.info(f"Batch saved in {save_elapsed:.1f}s ({new_count} new, {updated_count} updated)")
-                            total_new += new_count
-                            total_updated += updated_count
-                            total_found += len(batch_listings)
-                            batch_listings = []
-
-                            # Update scrape run progress
-                            self.storage.update_scrape_run(
-                                run_id,
-                                pages_scraped=i + 2,  # +1 for first page, +1 for 0-index
-                                listings_found=total_found,
-                                listings_new=total_new,
-                                listings_updated=total_updated,
-                            )
-
-                    # Retry failed pages up to 3 times
-                    retry_round = 1
-                    max_retry_rounds = 3
-                    while failed_pages and retry_round <= max_retry_rounds:
-                        logger.info(f"Retry round {retry_round}: {len(failed_pages)} failed pages to retry...")
-                        await asyncio.sleep(2)  # Small delay before retry
-
-                        retry_results = await client.fetch_pages(failed_pages, None)
-                        still_failed = []
-
-                        for result in retry_results:
-                            if "error" in result:
-                                still_failed.append(result["page"])
+                def progress_callback(done, total):
+                    # Called for every page; only do the rate math when logging
+                    if done % 100 and done != total:
+                        return
+                    elapsed = time.monotonic() - start_time
+                    rate = done / elapsed * 60 if elapsed > 0 else 0
+                    remaining = (total - done) / rate if rate > 0 else 0
+                    logger.info(
+                        f"Progress: {done}/{total} pages "
+                        f"({rate:.0f} pages/min, ~{remaining:.1f} min remaining)"
+                    )
+
+                pages_done = sum(1 for page in completed if page <= total_pages)
+                last_run_update = time.monotonic()
+                writer_error: Optional[Exception] = None
+                # Bounded so fetching can't run arbitrarily far ahead of the database
+                write_queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+
+                async def save_batch(batch_pages, batch_listings):
+                    nonlocal total_new, total_updated, total_found, pages_done, last_run_update
+                    logger.info(f"Saving batch of {len(batch_listings)} listings...")
+                    save_start = time.monotonic()
+                    new_count, updated_count = await self._db(self.storage.upsert_listings, batch_listings)
+                    save_elapsed = time.monotonic() - save_start
+                    logger.info(f"Batch saved in {save_elapsed:.1f}s ({new_count} new, {updated_count} updated)")
+                    total_new += new_count
+                    total_updated += updated_count
+                    total_found += len(batch_listings)
+                    pages_done += len(batch_pages)
+                    # Only pages whose listings are in the database count as done
+                    self.checkpoint_manager.complete_pages(
+                        checkpoint,
+                        batch_pages,
+                        new_listings=new_count,
+                        updated_listings=updated_count,
+                        found_listings=len(batch_listings),
+                    )
+
+                    # Update scrape run progress; the final totals are written once
+                    # fetching is done, so skipping some of these loses nothing
+                    if time.monotonic() - last_run_update >= PARALLEL_SCRAPE_RUN_UPDATE_SECONDS:
+                        await self._db(
+                            self.storage.update_scrape_run,
+                            run_id,
+                            pages_scraped=pages_done,
+                            listings_found=total_found,
+                            listings_new=total_new,
+                            listings_updated=total_updated,
+                        )
+                        last_run_update = time.monotonic()
+
+                async def db_writer():
+                    # Saves in a worker thread while the fetch workers carry on.
+                    # After a failed save it keeps draining the queue so no
+                    # producer blocks; the error is raised once fetching stops.
+                    nonlocal writer_error
+                    batch_pages = []
+                    # Keyed by id: results shift between pages while we paginate,
+                    # so the same listing can turn up twice (the later copy wins)
+                    batch_listings: dict[str, dict] = {}
+                    while True:
+                        item = await write_queue.get()
+                        if item is not None:
+                            page, page_listings = item
+                            batch_pages.append(page)
+                            for listing in page_listings:
+                                batch_listings[listing["id"]] = listing
+                            if len(batch_listings) < UPSERT_BATCH_SIZE:
                                 continue
 
-                            page_listings = client.extract_listings(result["data"])
-                            if page_listings:
-                                batch_listings.extend(page_listings)
-                                logger.info(f"Recovered page {result['page']}: {len(page_listings)} listings")
+                        if batch_pages and writer_error is None:
+                            try:
+                                await save_batch(batch_pages, list(batch_listings.values()))
+                            except Exception as e:
+                                logger.error(f"Failed to save batch: {e}")
+                                writer_error = e
+                        batch_pages = []
+                        batch_listings = {}
+
+                        if item is None:
+                            return
+
+                async def consume_page(page, page_listings):
+                    if writer_error:
+                        raise writer_error
+                    await write_queue.put((page, page_listings))
+
+                writer_task = asyncio.create_task(db_writer())
+                fetch_task = None
+                retry_task = None
+                try:
+                    # Get the other pages going before spending any time on page 1
+                    logger.info(f"Fetching {len(remaining_pages)} pages in parallel, saving in batches...")
+                    fetch_task = asyncio.ensure_future(
+                        client.fetch_pages(remaining_pages, consume_page, progress_callback, retries=PAGE_RETRIES)
+                    )
+
+                    if 1 not in completed:
+                        listings = client.extract_listings(first_response)
+                        logger.info(f"Page 1: {len(listings)} listings")
+                        await consume_page(1, listings)
+
+                    speculative_failed = []
+                    for page, task in speculative.items():
+                        result = await task
+                        if "error" in result:
+                            speculative_failed.append(page)
+                        else:
+                            await consume_page(page, client.extract_listings(result["data"]))
+                    speculative.clear()
+
+                    # Speculative pages that failed have used their first attempt;
+                    # retry them alongside the main stream, with the retries left
+                    if speculative_failed:
+                        retry_task = asyncio.ensure_future(
+                            client.fetch_pages(speculative_failed, consume_page, retries=PAGE_RETRIES - 1)
+                        )
+
+                    # Failed pages are retried with backoff inside the stream
+                    failed_results = await fetch_task
+                    if retry_task:
+                        failed_results += await retry_task
 
-                        failed_pages = still_failed
-                        retry_round += 1
+                    for result in failed_results:
+                        logger.warning(f"Page {result['page']} failed: {result['error']}")
+                    failed_pages = [result["page"] for result in failed_results]
 
                     if failed_pages:
-                        logger.error(f"PERMANENTLY FAILED: {len(failed_pages)} pages after {max_retry_rounds} retry rounds: {failed_pages[:20]}{'...' if len(failed_pages) > 20 else ''}")
-
-                    # Save remaining listings
-                    if batch_listings:
-                        logger.info(f"Saving final batch of {len(batch_listings)} listings...")
-                        save_start = time.time()
-                        new_count, updated_count = self.storage.upsert_listings(batch_listings)
-                        save_elapsed = time.time() - save_start
-                        logger.info(f"Final batch saved in {save_elapsed:.1f}s")
-                        total_new += new_count
-                        total_updated += updated_count
-                        total_found += len(batch_listings)
+                        logger.error(f"PERMANENTLY FAILED: {len(failed_pages)} pages after {PAGE_RETRIES} retries: {failed_pages[:20]}{'...' if len(failed_pages) > 20 else ''}")
+
+                    # Flush remaining listings
+                    await write_queue.put(None)
+                    await writer_task
+                    if writer_error:
+                        raise writer_error
+                finally:
+                    if fetch_task:
+                        fetch_task.cancel()
+                    if retry_task:
+                        retry_task.cancel()
+                    if not writer_task.done():
+                        # Interrupted: save the pages already fetched before giving up
+                        try:
+                            await write_queue.put(None)
+                            await writer_task
+                        except Exception as e:
+                            logger.error(f"Failed to save pending listings: {e}")
 
                 # Mark listings as inactive if not seen in this scrape
                 logger.info("Marking inactive listings...")
                 try:
-                    inactive_count = self.storage.mark_inactive_not_seen_since(scrape_start_time)
+                    inactive_count = await self._db(self.storage.mark_inactive_not_seen_since, scrape_start_time)
                     logger.info(f"Marked {inactive_count} listings as inactive")
                 except Exception as e:
                     logger.error(f"Error marking inactive listings: {e}")
@@ -367,7 +499,8 @@ class AsyncScraper:
                 # Update scrape run with final stats including inactive count
                 logger.info("Updating scrape run stats...")
                 try:
-                    self.storage.update_scrape_run(
+                    await self._db(
+                        self.storage.update_scrape_run,
                         run_id,
                         pages_scraped=total_pages,
                         listings_found=total_found,
@@ -379,10 +512,10 @@ class AsyncScraper:
                     logger.error(f"Error updating scrape run: {e}")
 
                 # Final stats
-                elapsed = time.time() - start_time
+                elapsed = time.monotonic() - start_time
                 logger.info("Getting database stats...")
                 try:
-                    stats = self.storage.get_stats()
+                    stats = await self._db(self.storage.get_stats)
                 except Exception as e:
                     logger.error(f"Error getting stats: {e}")
                     stats = {"total_listings": 0, "active_listings": 0, "below_market_count": 0}
@@ -403,7 +536,9 @@ class AsyncScraper:
                 }
 
                 # Complete run with details
-                self.storage.complete_scrape_run(run_id, scrape_details=scrape_details)
+                await self._db(self.storage.complete_scrape_run, run_id, scrape_details=scrape_details)
+                await self.checkpoint_manager.stop()
+                self.checkpoint_manager.mark_completed(checkpoint)
 
                 logger.info("=" * 50)
                 logger.info("Scrape completed successfully!")
@@ -432,19 +567,38 @@ class AsyncScraper:
                     **stats,
                 }
 
-        except KeyboardInterrupt:
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            # asyncio.run() turns Ctrl+C into a cancellation of this task
             logger.warning("Scrape interrupted by user")
-            self.storage.complete_scrape_run(run_id, status="interrupted")
+            for task in speculative.values():
+                task.cancel()
+            await self.checkpoint_manager.stop()
+            run_id = await self._created_run_id(run_id_task)
+            if run_id is not None:
+                await self._db(self.storage.complete_scrape_run, run_id, status="interrupted")
             return {"status": "interrupted"}
 
         except Exception as e:
             logger.error(f"Scrape failed: {e}")
-            self.storage.complete_scrape_run(run_id, status="failed", error=str(e))
+            for task in speculative.values():
+                task.cancel()
+            await self.checkpoint_manager.stop()
+            if checkpoint:
+                self.checkpoint_manager.mark_failed(checkpoint, str(e))
+            run_id = await self._created_run_id(run_id_task)
+            if run_id is not None:
+                await self._db(self.storage.complete_scrape_run, run_id, status="failed", error=str(e))
             raise
 
+        finally:
+            # The database thread holds its own connection
+            await self._db(self.storage.close)
+            # Nothing is queued any more, so this returns as soon as the thread exits
+            self._db_executor.shutdown(wait=True)
+
 
-def main():
-    """CLI entry point"""
+def main(argv: Optional[list[str]] = None):
+    """CLI entry point; argv defaults to sys.argv[1:]"""
     parser = argparse.ArgumentParser(description="StandVirtual Car Listings Scraper")
     parser.add_argument(
         "--max-pages",
@@ -473,13 +627,19 @@ def main():
         default=10,
         help="Number of concurrent connections for parallel mode (default: 10)"
     )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=None,
+        help="Let parallel mode raise concurrency up to this while requests succeed (default: --concurrency)"
+    )
     parser.add_argument(
         "-v", "--verbose",
         action="store_true",
         help="Enable verbose logging"
     )
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     if args.verbose:
         logging.getLogger().setLevel(logging.DEBUG)
@@ -489,14 +649,27 @@ def main():
         max_pages = 5
         logger.info("Test mode: limiting to 5 pages")
 
+    resume = not args.no_resume
+
     if args.parallel:
         # Use async parallel scraper
-        scraper = AsyncScraper(max_pages=max_pages, concurrency=args.concurrency)
-        result = asyncio.run(scraper.run())
+        scraper = AsyncScraper(
+            max_pages=max_pages,
+            concurrency=args.concurrency,
+            max_concurrency=args.max_concurrency,
+        )
+
+        async def run_parallel():
+            try:
+                return await scraper.run(resume=resume)
+            finally:
+                await close_session()
+
+        result = asyncio.run(run_parallel())
     else:
         # Use sequential scraper
         scraper = Scraper(max_pages=max_pages)
-        result = scraper.run(resume=not args.no_resume)
+        result = scraper.run(resume=resume)
 
     return 0 if result.get("status") in ("completed", "interrupted") else 1
 
@@ -8,6 +8,8 @@ Usage:
 import sqlite3
 import os
 import sys
+import queue
+import threading
 from pathlib import Path
 
 # Try to import libsql
@@ -20,6 +22,10 @@ except ImportError:
 # Local database path
 LOCAL_DB = Path(__file__).parent / "data" / "listings.db"
 
+BATCH_SIZE = 500
+# Every commit is a round trip to Turso; commit every N batches instead of each one
+COMMIT_EVERY_BATCHES = 20
+
 # Turso credentials from environment
 TURSO_URL = os.environ.get("TURSO_DATABASE_URL")
 TURSO_TOKEN = os.environ.get("TURSO_AUTH_TOKEN")
@@ -35,11 +41,72 @@ if not LOCAL_DB.exists():
     sys.exit(1)
 
 
+def copy_rows(local_conn, turso_conn, table: str, insert_sql: str) -> int:
+    """
+    Copy every row of a local table to Turso.
+
+    Rows are read BATCH_SIZE at a time from the local cursor, so the table
+    is never held in memory whole. A reader thread fetches the next batches
+    while this thread sends the current ones over the single Turso
+    connection (Turso allows one writer at a time), committing every
+    COMMIT_EVERY_BATCHES batches.
+    """
+    total = local_conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    print(f"  Found {total} rows")
+
+    cursor = local_conn.execute(f"SELECT * FROM {table}")
+    # Bounded so reading never runs more than one commit's worth ahead
+    batches: queue.Queue = queue.Queue(maxsize=COMMIT_EVERY_BATCHES)
+    stop = threading.Event()
+
+    def read_batches():
+        try:
+            while not stop.is_set():
+                batch = cursor.fetchmany(BATCH_SIZE)
+                batches.put(batch)  # An empty batch marks the end
+                if not batch:
+                    return
+        except Exception as e:
+            batches.put(e)
+
+    reader = threading.Thread(target=read_batches, daemon=True)
+    reader.start()
+
+    copied = 0
+    batch_count = 0
+    try:
+        while True:
+            batch = batches.get()
+            if isinstance(batch, Exception):
+                raise batch
+            if not batch:
+                break
+            turso_conn.executemany(insert_sql, batch)
+            copied += len(batch)
+            batch_count += 1
+            if batch_count % COMMIT_EVERY_BATCHES == 0:
+                turso_conn.commit()
+                print(f"  Migrated {copied}/{total} rows")
+        turso_conn.commit()
+    finally:
+        # Unblock the reader if writing failed part way
+        stop.set()
+        while reader.is_alive():
+            try:
+                batches.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+    print(f"  Migrated {copied}/{total} rows")
+    return copied
+
+
 def migrate():
     """Migrate all data from local SQLite to Turso"""
     print(f"Connecting to local database: {LOCAL_DB}")
-    local_conn = sqlite3.connect(LOCAL_DB)
-    local_conn.row_factory = sqlite3.Row
+    # Plain tuple rows can be handed to executemany as they are; copy_rows
+    # reads through this connection from its reader thread
+    local_conn = sqlite3.connect(LOCAL_DB, check_same_thread=False)
 
     print(f"Connecting to Turso: {TURSO_URL}")
     turso_conn = libsql.connect(database=TURSO_URL, auth_token=TURSO_TOKEN)
@@ -123,30 +190,25 @@ def migrate():
 
     # Migrate listings
     print("Migrating listings...")
-    listings = local_conn.execute("SELECT * FROM listings").fetchall()
-    print(f"  Found {len(listings)} listings")
-
-    batch_size = 500
-    for i in range(0, len(listings), batch_size):
-        batch = listings[i:i+batch_size]
-        turso_conn.executemany("""
+    listings_count = copy_rows(
+        local_conn,
+        turso_conn,
+        "listings",
+        """
             INSERT OR REPLACE INTO listings VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, [tuple(row) for row in batch])
-        turso_conn.commit()
-        print(f"  Migrated {min(i+batch_size, len(listings))}/{len(listings)} listings")
+        """,
+    )
 
     # Migrate price_history
     print("Migrating price history...")
-    history = local_conn.execute("SELECT * FROM price_history").fetchall()
-    print(f"  Found {len(history)} price history entries")
-
-    for i in range(0, len(history), batch_size):
-        batch = history[i:i+batch_size]
-        turso_conn.executemany("""
+    history_count = copy_rows(
+        local_conn,
+        turso_conn,
+        "price_history",
+        """
             INSERT OR REPLACE INTO price_history VALUES (?, ?, ?, ?)
-        """, [tuple(row) for row in batch])
-        turso_conn.commit()
-        print(f"  Migrated {min(i+batch_size, len(history))}/{len(history)} entries")
+        """,
+    )
 
     # Migrate saved_deals
     print("Migrating saved deals...")
@@ -155,7 +217,7 @@ def migrate():
     if saved:
         turso_conn.executemany("""
             INSERT OR REPLACE INTO saved_deals VALUES (?, ?, ?, ?)
-        """, [tuple(row) for row in saved])
+        """, saved)
         turso_conn.commit()
 
     # Migrate scrape_runs (last 10 only)
@@ -165,7 +227,7 @@ def migrate():
     if runs:
         turso_conn.executemany("""
             INSERT OR REPLACE INTO scrape_runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, [tuple(row) for row in runs])
+        """, runs)
         turso_conn.commit()
 
     # Migrate settings
@@ -175,15 +237,15 @@ def migrate():
     if settings:
         turso_conn.executemany("""
             INSERT OR REPLACE INTO settings VALUES (?, ?, ?, ?)
-        """, [tuple(row) for row in settings])
+        """, settings)
         turso_conn.commit()
 
     local_conn.close()
     turso_conn.close()
 
     print("\n✅ Migration complete!")
-    print(f"   Listings: {len(listings)}")
-    print(f"   Price history: {len(history)}")
+    print(f"   Listings: {listings_count}")
+    print(f"   Price history: {history_count}")
     print(f"   Saved deals: {len(saved)}")
 
 
@@ -3,18 +3,58 @@ Adaptive rate limiter for API requests
 """
 import time
 import random
+import asyncio
 import logging
+from email.utils import parsedate_to_datetime
 from typing import Optional
 
 from config import (
     REQUESTS_PER_MINUTE,
     MIN_DELAY_SECONDS,
     MAX_DELAY_SECONDS,
+    MAX_RETRY_AFTER_SECONDS,
 )
 
 logger = logging.getLogger(__name__)
 
 
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a Retry-After header value into seconds.
+
+    Accepts both forms allowed by RFC 9110: delay-seconds ("120") and an
+    HTTP-date ("Wed, 21 Oct 2015 07:28:00 GMT"). Returns None if missing
+    or unparseable.
+    """
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+        return max(0.0, retry_at.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def get_rate_limit_delay(retry_after: Optional[str], attempt: int) -> float:
+    """
+    Seconds to wait after a 429 response.
+
+    Uses the server's Retry-After when given, otherwise exponential backoff
+    with up to 50% jitter so parallel requests don't retry in lockstep.
+    Capped at MAX_RETRY_AFTER_SECONDS.
+    """
+    delay = parse_retry_after(retry_after)
+    if delay is None:
+        delay = (2 ** attempt) * (1 + random.random() * 0.5)
+    return min(MAX_RETRY_AFTER_SECONDS, max(0.5, delay))
+
+
 class AdaptiveRateLimiter:
     """
     Rate limiter with adaptive backoff on errors.
@@ -23,6 +63,9 @@ class AdaptiveRateLimiter:
     - Random jitter between requests
     - Exponential backoff on rate limit errors
     - Gradual recovery after successful requests
+
+    Request times come from the monotonic clock. The jittered delay range only
+    changes with the backoff, so it is recomputed there rather than per request.
     """
 
     def __init__(
@@ -38,31 +81,52 @@ class AdaptiveRateLimiter:
         self.last_request_time: Optional[float] = None
         self.consecutive_successes = 0
         self.backoff_multiplier = 1.0
+        self._update_delay_range()
 
     def wait(self):
         """Wait before next request with jitter"""
         if self.last_request_time is not None:
-            elapsed = time.time() - self.last_request_time
-            delay = self._calculate_delay()
+            elapsed = time.monotonic() - self.last_request_time
+            # Most waits are already over; skip drawing a delay for those
+            if elapsed < self._delay_hi:
+                delay = self._calculate_delay()
+                if elapsed < delay:
+                    sleep_time = delay - elapsed
+                    logger.debug(f"Rate limit: sleeping {sleep_time:.2f}s")
+                    time.sleep(sleep_time)
+
+        self.last_request_time = time.monotonic()
+
+    async def throttle(self):
+        """
+        Async pacing for concurrent workers.
+
+        Requests go out unpaced while things are healthy; once backed off, each
+        caller reserves the next slot `_calculate_delay()` after the previous
+        one and sleeps until then without blocking the event loop.
+        """
+        if self.backoff_multiplier <= 1.0:
+            return
+
+        now = time.monotonic()
+        next_time = now
+        if self.last_request_time is not None:
+            next_time = max(now, self.last_request_time + self._calculate_delay())
+        self.last_request_time = next_time
 
-            if elapsed < delay:
-                sleep_time = delay - elapsed
-                logger.debug(f"Rate limit: sleeping {sleep_time:.2f}s")
-                time.sleep(sleep_time)
+        if next_time > now:
+            await asyncio.sleep(next_time - now)
 
-        self.last_request_time = time.time()
+    def _update_delay_range(self):
+        """Recompute the jittered delay range; call whenever the backoff changes"""
+        # Apply backoff multiplier, allow ±20% jitter, clamp to bounds
+        delay = self.current_delay * self.backoff_multiplier
+        self._delay_lo = max(self.min_delay, min(self.max_delay, delay * 0.8))
+        self._delay_hi = max(self.min_delay, min(self.max_delay, delay * 1.2))
 
     def _calculate_delay(self) -> float:
         """Calculate delay with jitter and backoff"""
-        # Apply backoff multiplier
-        delay = self.current_delay * self.backoff_multiplier
-
-        # Add random jitter (±20%)
-        jitter = delay * 0.2 * (2 * random.random() - 1)
-        delay += jitter
-
-        # Clamp to bounds
-        return max(self.min_delay, min(self.max_delay, delay))
+        return random.uniform(self._delay_lo, self._delay_hi)
 
     def on_success(self):
         """Call after successful request"""
@@ -71,6 +135,7 @@ class AdaptiveRateLimiter:
         # Gradually reduce backoff after 5 consecutive successes
         if self.consecutive_successes >= 5 and self.backoff_multiplier > 1.0:
             self.backoff_multiplier = max(1.0, self.backoff_multiplier * 0.9)
+            self._update_delay_range()
             logger.info(f"Reducing backoff to {self.backoff_multiplier:.2f}x")
             self.consecutive_successes = 0
 
@@ -78,6 +143,7 @@ class AdaptiveRateLimiter:
         """Call when rate limited"""
         self.consecutive_successes = 0
         self.backoff_multiplier = min(4.0, self.backoff_multiplier * 2.0)
+        self._update_delay_range()
         logger.warning(f"Rate limited! Increasing backoff to {self.backoff_multiplier:.2f}x")
 
     def on_error(self):
@@ -85,11 +151,13 @@ class AdaptiveRateLimiter:
         self.consecutive_successes = 0
         # Smaller backoff for non-rate-limit errors
         self.backoff_multiplier = min(2.0, self.backoff_multiplier * 1.5)
+        self._update_delay_range()
 
     def get_stats(self) -> dict:
         """Get current rate limiter stats"""
         return {
-            "current_delay": self._calculate_delay(),
+            # The delay before jitter, so repeated calls report the same value
+            "current_delay": max(self.min_delay, min(self.max_delay, self.current_delay * self.backoff_multiplier)),
             "backoff_multiplier": self.backoff_multiplier,
             "consecutive_successes": self.consecutive_successes,
         }
@@ -8,31 +8,56 @@ Calculates a 0-100 deal score based on:
 - Listing freshness - 10% weight
 """
 import json
+import time
 from datetime import datetime
 from typing import Optional
 
+# Every listing gets a breakdown serialized; orjson is several times faster
+# than json for these small dicts
+try:
+    import orjson
 
-def calculate_deal_score(listing: dict) -> tuple[float, dict]:
+    def _dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+except ImportError:
+    def _dumps(obj) -> str:
+        return json.dumps(obj, separators=(",", ":"))
+
+# BELOW = 100, IN = 50, ABOVE = 10; anything else scores as average
+_PRICE_SCORES = {"BELOW": 100, "IN": 50, "ABOVE": 10}
+
+
+def calculate_deal_score(
+    listing: dict,
+    now_ts: Optional[float] = None,
+    current_year: Optional[int] = None,
+) -> tuple[float, dict]:
     """
     Calculate deal score for a listing.
 
+    Args:
+        listing: Parsed listing
+        now_ts: Current Unix time; pass it in when scoring a batch
+        current_year: Current calendar year; pass it in when scoring a batch
+
     Returns:
         Tuple of (score 0-100, breakdown dict)
     """
+    if now_ts is None:
+        now_ts = time.time()
+    if current_year is None:
+        current_year = datetime.now().year
+
     breakdown = {}
     total_score = 0
 
     # 1. Price Evaluation Score (50% weight)
-    # BELOW = 100, IN = 50, ABOVE = 0
-    price_eval = listing.get("price_evaluation", "").upper()
-    if price_eval == "BELOW":
-        price_score = 100
-    elif price_eval == "IN":
-        price_score = 50
-    elif price_eval == "ABOVE":
-        price_score = 10
-    else:
-        price_score = 50  # Unknown = average
+    # The API sends upper case; only normalize (and handle None) on a miss
+    price_eval = listing.get("price_evaluation")
+    price_score = _PRICE_SCORES.get(price_eval)
+    if price_score is None:
+        price_eval = price_eval.upper() if price_eval else ""
+        price_score = _PRICE_SCORES.get(price_eval, 50)  # Unknown = average
 
     breakdown["price_evaluation"] = {
         "score": price_score,
@@ -48,7 +73,6 @@ def calculate_deal_score(listing: dict) -> tuple[float, dict]:
     mileage = listing.get("mileage")
 
     if year and mileage:
-        current_year = datetime.now().year
         car_age = max(1, current_year - year)
         expected_mileage = car_age * 15000
 
@@ -88,7 +112,6 @@ def calculate_deal_score(listing: dict) -> tuple[float, dict]:
     # 3. Age Score (15% weight)
     # Newer cars score higher
     if year:
-        current_year = datetime.now().year
         car_age = current_year - year
 
         if car_age <= 1:
@@ -127,11 +150,9 @@ def calculate_deal_score(listing: dict) -> tuple[float, dict]:
     if listing_date:
         # listing_date is Unix timestamp
         if isinstance(listing_date, (int, float)):
-            listing_dt = datetime.fromtimestamp(listing_date)
+            days_old = int((now_ts - listing_date) // 86400)
         else:
-            listing_dt = datetime.now()
-
-        days_old = (datetime.now() - listing_dt).days
+            days_old = 0
 
         if days_old <= 1:
             freshness_score = 100
@@ -170,11 +191,19 @@ def calculate_deal_score(listing: dict) -> tuple[float, dict]:
 def calculate_scores_for_listings(listings: list[dict]) -> list[dict]:
     """
     Calculate deal scores for a batch of listings.
-    Adds deal_score and score_breakdown to each listing.
+    Adds deal_score and score_breakdown (JSON) to each listing.
+
+    Storage scores each upsert batch through here, so per-batch work
+    is done once rather than per listing.
     """
+    now_ts = time.time()
+    current_year = datetime.now().year
+
+    score_listing = calculate_deal_score
+    dumps = _dumps
     for listing in listings:
-        score, breakdown = calculate_deal_score(listing)
+        score, breakdown = score_listing(listing, now_ts, current_year)
         listing["deal_score"] = score
-        listing["score_breakdown"] = json.dumps(breakdown)
+        listing["score_breakdown"] = dumps(breakdown)
 
     return listings
@@ -2,34 +2,123 @@
 PostgreSQL storage layer for listings - optimized for batch operations
 Supports both local SQLite (dev) and PostgreSQL/Supabase (production)
 """
+import io
 import sqlite3
 import json
+import threading
 import time
 import logging
 from pathlib import Path
 from typing import Optional
 from contextlib import contextmanager
 
-from config import DATABASE_PATH, USE_POSTGRES, DATABASE_URL
-from scoring import calculate_deal_score
+from config import (
+    DATABASE_PATH,
+    USE_POSTGRES,
+    DATABASE_URL,
+    UPSERT_BATCH_SIZE,
+    MARK_INACTIVE_BATCH_SIZE,
+    PG_POOL_MAX_CONNECTIONS,
+)
+from scoring import calculate_scores_for_listings
 
 logger = logging.getLogger(__name__)
 
+# Badges are serialized for every listing; orjson is several times faster than json
+try:
+    import orjson
+
+    def _dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+except ImportError:
+    def _dumps(obj) -> str:
+        return json.dumps(obj, separators=(",", ":"))
+
 # Try to import psycopg2 for PostgreSQL support
 try:
-    import psycopg2
-    from psycopg2.extras import execute_values, RealDictCursor
+    from psycopg2.pool import ThreadedConnectionPool
     PSYCOPG2_AVAILABLE = True
 except ImportError:
     PSYCOPG2_AVAILABLE = False
 
 
+# SQLite caps bind parameters per statement; probe existing ids this many at a time
+SQLITE_MAX_IN_PARAMS = 500
+
+# Insert new rows, update existing ones in place (first_seen_at/created_at are
+# only written on insert)
+SQLITE_UPSERT_SQL = """
+    INSERT INTO listings (
+        id, title, url, price, price_evaluation,
+        make, model, version, year, mileage,
+        fuel_type, gearbox, engine_capacity, engine_power,
+        city, region, seller_name, seller_type,
+        thumbnail_url, badges, deal_score, score_breakdown, is_active,
+        listing_date, first_seen_at, last_seen_at, created_at
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1, ?, ?, ?, ?)
+    ON CONFLICT(id) DO UPDATE SET
+        title = excluded.title,
+        url = excluded.url,
+        price = excluded.price,
+        price_evaluation = excluded.price_evaluation,
+        make = excluded.make,
+        model = excluded.model,
+        version = excluded.version,
+        year = excluded.year,
+        mileage = excluded.mileage,
+        fuel_type = excluded.fuel_type,
+        gearbox = excluded.gearbox,
+        engine_capacity = excluded.engine_capacity,
+        engine_power = excluded.engine_power,
+        city = excluded.city,
+        region = excluded.region,
+        seller_name = excluded.seller_name,
+        seller_type = excluded.seller_type,
+        thumbnail_url = excluded.thumbnail_url,
+        badges = excluded.badges,
+        listing_date = COALESCE(excluded.listing_date, listings.listing_date),
+        deal_score = excluded.deal_score,
+        score_breakdown = excluded.score_breakdown,
+        is_active = 1,
+        last_seen_at = excluded.last_seen_at
+"""
+
+
+# Column order shared by the PostgreSQL upsert rows, the COPY and the merge
+PG_LISTING_COLUMNS = (
+    "id, title, url, price, price_evaluation, "
+    "make, model, version, year, mileage, "
+    "fuel_type, gearbox, engine_capacity, engine_power, "
+    "city, region, seller_name, seller_type, "
+    "thumbnail_url, badges, deal_score, score_breakdown, is_active, "
+    "listing_date, first_seen_at, last_seen_at, created_at"
+)
+
+
+def _copy_field(value) -> str:
+    """Format one value for COPY's text format"""
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
 class Storage:
     """Storage for car listings - supports SQLite (dev) and PostgreSQL (prod)"""
 
     def __init__(self, db_path: Path = DATABASE_PATH):
         self.db_path = db_path
         self.use_postgres = USE_POSTGRES and PSYCOPG2_AVAILABLE
+        # SQLite connections can't cross threads; keep one open per thread
+        self._local = threading.local()
+        self._pg_pool = None
 
         if self.use_postgres:
             # Debug: show connection info (mask password)
@@ -52,6 +141,9 @@ class Storage:
             self._ensure_postgres_tables()
         else:
             self._ensure_sqlite_tables()
+            # Later calls may run on another thread (the async scraper's database
+            # thread), which opens its own connection; don't leave this one behind
+            self.close()
 
     def _ensure_postgres_tables(self):
         """Create PostgreSQL tables"""
@@ -132,6 +224,8 @@ class Storage:
             "CREATE INDEX IF NOT EXISTS idx_listings_deal_score ON listings(deal_score)",
             "CREATE INDEX IF NOT EXISTS idx_listings_price_evaluation ON listings(price_evaluation)",
             "CREATE INDEX IF NOT EXISTS idx_listings_region ON listings(region)",
+            # Only active rows are ever checked against last_seen_at
+            "CREATE INDEX IF NOT EXISTS idx_listings_active_last_seen ON listings(last_seen_at) WHERE is_active = TRUE",
         ]
 
         with self._get_connection() as conn:
@@ -218,6 +312,8 @@ class Storage:
             "CREATE INDEX IF NOT EXISTS idx_listings_deal_score ON listings(deal_score)",
             "CREATE INDEX IF NOT EXISTS idx_listings_price_evaluation ON listings(price_evaluation)",
             "CREATE INDEX IF NOT EXISTS idx_listings_region ON listings(region)",
+            # Only active rows are ever checked against last_seen_at
+            "CREATE INDEX IF NOT EXISTS idx_listings_active_last_seen ON listings(last_seen_at) WHERE is_active = 1",
         ]
 
         with self._get_connection() as conn:
@@ -228,113 +324,121 @@ class Storage:
     def _get_connection(self):
         """Get database connection"""
         if self.use_postgres:
-            # Parse the URL and extract components (handles URL-encoded passwords)
-            from urllib.parse import urlparse, unquote
-            # Strip any whitespace/newlines from the URL
-            url = DATABASE_URL.strip() if DATABASE_URL else None
-            parsed = urlparse(url)
-
-            # Debug log the parsed components
-            logger.info(f"Connecting: host={parsed.hostname}, port={parsed.port}, user={parsed.username}, db={parsed.path}")
-
-            conn = psycopg2.connect(
-                host=parsed.hostname,
-                port=parsed.port,
-                user=parsed.username,
-                password=unquote(parsed.password) if parsed.password else None,
-                dbname=parsed.path.lstrip('/').strip()
-            )
+            # Borrow a pooled connection instead of reconnecting (TCP + TLS + auth) per call
+            if self._pg_pool is None:
+                self._pg_pool = self._connect_postgres_pool()
+            conn = self._pg_pool.getconn()
             try:
                 yield conn
                 conn.commit()
             except Exception:
-                conn.rollback()
+                if not conn.closed:
+                    conn.rollback()
                 raise
             finally:
-                conn.close()
+                # Drop connections the server (or a pooler) has closed under us
+                self._pg_pool.putconn(conn, close=bool(conn.closed))
         else:
-            # Use local SQLite
-            conn = sqlite3.connect(self.db_path)
-            conn.execute("PRAGMA journal_mode=WAL")
-            conn.execute("PRAGMA synchronous=NORMAL")
-            conn.execute("PRAGMA cache_size=-64000")
-            conn.execute("PRAGMA temp_store=MEMORY")
-            conn.row_factory = sqlite3.Row
+            # Use local SQLite: one long-lived connection per thread
+            conn = getattr(self._local, "conn", None)
+            if conn is None:
+                conn = self._local.conn = self._connect_sqlite()
             try:
                 yield conn
                 conn.commit()
             except Exception:
                 conn.rollback()
                 raise
-            finally:
-                conn.close()
+
+    def _connect_postgres_pool(self) -> "ThreadedConnectionPool":
+        """Create the PostgreSQL connection pool"""
+        # Parse the URL and extract components (handles URL-encoded passwords)
+        from urllib.parse import urlparse, unquote
+        # Strip any whitespace/newlines from the URL
+        url = DATABASE_URL.strip() if DATABASE_URL else None
+        parsed = urlparse(url)
+
+        # Debug log the parsed components
+        logger.info(f"Connecting: host={parsed.hostname}, port={parsed.port}, user={parsed.username}, db={parsed.path}")
+
+        return ThreadedConnectionPool(
+            1,
+            PG_POOL_MAX_CONNECTIONS,
+            host=parsed.hostname,
+            port=parsed.port,
+            user=parsed.username,
+            password=unquote(parsed.password) if parsed.password else None,
+            dbname=parsed.path.lstrip('/').strip()
+        )
+
+    def _connect_sqlite(self) -> sqlite3.Connection:
+        """Open a SQLite connection with the PRAGMAs applied once"""
+        conn = sqlite3.connect(self.db_path)
+        # page_size only takes effect on a database that hasn't been written yet
+        conn.execute("PRAGMA page_size=8192")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA cache_size=-64000")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA mmap_size=268435456")
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def close(self):
+        """Close the PostgreSQL pool, or this thread's SQLite connection"""
+        if self._pg_pool is not None:
+            self._pg_pool.closeall()
+            self._pg_pool = None
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
 
     def upsert_listings(self, listings: list[dict]) -> tuple[int, int]:
         """
-        Batch upsert listings.
+        Batch upsert listings, committing every UPSERT_BATCH_SIZE rows.
         Returns: Tuple of (new_count, updated_count)
         """
-        if self.use_postgres:
-            return self._postgres_upsert_listings(listings)
-        return self._sqlite_upsert_listings(listings)
+        upsert = self._postgres_upsert_listings if self.use_postgres else self._sqlite_upsert_listings
 
-    def _postgres_upsert_listings(self, listings: list[dict]) -> tuple[int, int]:
+        # Deduplicate by ID (keep the last occurrence) so no batch sees an id twice
+        listings = list({listing["id"]: listing for listing in listings}.values())
+
+        # Every row written by one call shares a single timestamp
+        now = int(time.time())
+        total_new = 0
+        total_updated = 0
+        for i in range(0, len(listings), UPSERT_BATCH_SIZE):
+            new_count, updated_count = upsert(listings[i:i + UPSERT_BATCH_SIZE], now)
+            total_new += new_count
+            total_updated += updated_count
+        return total_new, total_updated
+
+    def _postgres_upsert_listings(self, listings: list[dict], now: int) -> tuple[int, int]:
         """PostgreSQL upsert using ON CONFLICT"""
         if not listings:
             return 0, 0
 
         from datetime import datetime
-        now = datetime.utcnow()
-
-        # Deduplicate listings by ID (keep the last occurrence)
-        seen_ids = {}
-        for listing in listings:
-            seen_ids[listing["id"]] = listing
-        listings = list(seen_ids.values())
-        logger.info(f"Deduplicated to {len(listings)} unique listings")
+        now = datetime.utcfromtimestamp(now)
 
         with self._get_connection() as conn:
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-
-            # Get existing IDs and prices
-            listing_ids = [l["id"] for l in listings]
-            cursor.execute(
-                "SELECT id, price FROM listings WHERE id = ANY(%s)",
-                (listing_ids,)
-            )
-            existing_map = {row["id"]: row["price"] for row in cursor.fetchall()}
-
-            new_count = 0
-            updated_count = 0
-            price_history_data = []
+            cursor = conn.cursor()
 
-            # Prepare data for upsert
-            upsert_data = []
+            # Format rows straight into the COPY buffer; no intermediate row list
+            calculate_scores_for_listings(listings)
+            buf = io.StringIO()
             for listing in listings:
-                score, breakdown = calculate_deal_score(listing)
-                listing_id = listing["id"]
-                new_price = listing["price"]
-
-                is_existing = listing_id in existing_map
-                if is_existing:
-                    updated_count += 1
-                    old_price = existing_map[listing_id]
-                    if old_price != new_price:
-                        price_history_data.append((listing_id, new_price, now))
-                else:
-                    new_count += 1
-                    price_history_data.append((listing_id, new_price, now))
-
                 # Convert listing_date if it's a unix timestamp
                 listing_date = listing.get("listing_date")
                 if listing_date and isinstance(listing_date, int):
                     listing_date = datetime.utcfromtimestamp(listing_date)
 
-                upsert_data.append((
-                    listing_id,
+                buf.write("\t".join(map(_copy_field, (
+                    listing["id"],
                     listing["title"],
                     listing["url"],
-                    new_price,
+                    listing["price"],
                     listing["price_evaluation"],
                     listing["make"],
                     listing["model"],
@@ -350,29 +454,41 @@ class Storage:
                     listing.get("seller_name"),
                     listing.get("seller_type"),
                     listing.get("thumbnail_url"),
-                    json.dumps(listing.get("badges", [])),
-                    score,
-                    json.dumps(breakdown),
+                    _dumps(listing.get("badges", [])),
+                    listing["deal_score"],
+                    listing["score_breakdown"],
                     True,  # is_active
                     listing_date,
                     now,  # first_seen_at (for new)
                     now,  # last_seen_at
                     now,  # created_at (for new)
-                ))
+                ))))
+                buf.write("\n")
+            buf.seek(0)
 
-            # Bulk upsert using execute_values with ON CONFLICT
-            if upsert_data:
-                execute_values(
-                    cursor,
-                    """
-                    INSERT INTO listings (
-                        id, title, url, price, price_evaluation,
-                        make, model, version, year, mileage,
-                        fuel_type, gearbox, engine_capacity, engine_power,
-                        city, region, seller_name, seller_type,
-                        thumbnail_url, badges, deal_score, score_breakdown, is_active,
-                        listing_date, first_seen_at, last_seen_at, created_at
-                    ) VALUES %s
+            # Bulk load: COPY the batch into a staging table (no per-row parse/plan),
+            # then resolve conflicts in one server-side INSERT ... SELECT
+            cursor.execute(
+                "CREATE TEMP TABLE IF NOT EXISTS listings_stage "
+                "(LIKE listings INCLUDING DEFAULTS) ON COMMIT DROP"
+            )
+            cursor.copy_expert(f"COPY listings_stage ({PG_LISTING_COLUMNS}) FROM STDIN", buf)
+
+            # One round trip for the rest: price changes are recorded first, while
+            # the old prices are still in listings; then the merge, whose new rows
+            # (xmax = 0) start their price history in the same statement. The FK
+            # on price_history is checked at the end of that statement, once the
+            # listings rows exist.
+            cursor.execute(f"""
+                INSERT INTO price_history (listing_id, price, recorded_at)
+                SELECT s.id, s.price, %(now)s
+                FROM listings_stage s
+                JOIN listings l ON l.id = s.id
+                WHERE l.price IS DISTINCT FROM s.price;
+
+                WITH merged AS (
+                    INSERT INTO listings ({PG_LISTING_COLUMNS})
+                    SELECT {PG_LISTING_COLUMNS} FROM listings_stage
                     ON CONFLICT (id) DO UPDATE SET
                         title = EXCLUDED.title,
                         url = EXCLUDED.url,
@@ -398,70 +514,65 @@ class Storage:
                         is_active = TRUE,
                         listing_date = COALESCE(EXCLUDED.listing_date, listings.listing_date),
                         last_seen_at = EXCLUDED.last_seen_at
-                    """,
-                    upsert_data
-                )
-
-            # Insert price history
-            if price_history_data:
-                execute_values(
-                    cursor,
-                    "INSERT INTO price_history (listing_id, price, recorded_at) VALUES %s",
-                    price_history_data
+                    RETURNING id, price, (xmax = 0) AS inserted
+                ), history AS (
+                    INSERT INTO price_history (listing_id, price, recorded_at)
+                    SELECT id, price, %(now)s FROM merged WHERE inserted
                 )
+                SELECT COUNT(*) FILTER (WHERE inserted) FROM merged
+            """, {"now": now})
+            new_count = cursor.fetchone()[0]
 
             conn.commit()
 
-        return new_count, updated_count
+        return new_count, len(listings) - new_count
 
-    def _sqlite_upsert_listings(self, listings: list[dict]) -> tuple[int, int]:
-        """SQLite bulk upsert using temp table"""
+    def _sqlite_upsert_listings(self, listings: list[dict], now: int) -> tuple[int, int]:
+        """SQLite upsert using ON CONFLICT, one executemany per batch"""
         if not listings:
             return 0, 0
 
-        now = int(time.time())
-
         with self._get_connection() as conn:
-            # Create temp table
-            conn.execute("""
-                CREATE TEMP TABLE IF NOT EXISTS temp_listings (
-                    id TEXT PRIMARY KEY,
-                    title TEXT,
-                    url TEXT,
-                    price INTEGER,
-                    price_evaluation TEXT,
-                    make TEXT,
-                    model TEXT,
-                    version TEXT,
-                    year INTEGER,
-                    mileage INTEGER,
-                    fuel_type TEXT,
-                    gearbox TEXT,
-                    engine_capacity INTEGER,
-                    engine_power INTEGER,
-                    city TEXT,
-                    region TEXT,
-                    seller_name TEXT,
-                    seller_type TEXT,
-                    thumbnail_url TEXT,
-                    badges TEXT,
-                    listing_date INTEGER,
-                    deal_score REAL,
-                    score_breakdown TEXT
-                )
-            """)
+            # Take the write lock up front so the probe, upsert and price history
+            # share one transaction (one sync at commit) and can't hit SQLITE_BUSY
+            # halfway through upgrading from a read lock
+            conn.execute("BEGIN IMMEDIATE")
+
+            # Get existing IDs and prices, chunked to stay under the bind-parameter limit
+            listing_ids = [l["id"] for l in listings]
+            existing_map = {}
+            for i in range(0, len(listing_ids), SQLITE_MAX_IN_PARAMS):
+                chunk = listing_ids[i:i + SQLITE_MAX_IN_PARAMS]
+                placeholders = ",".join("?" * len(chunk))
+                existing_map.update(conn.execute(
+                    f"SELECT id, price FROM listings WHERE id IN ({placeholders})",
+                    chunk
+                ).fetchall())
 
-            conn.execute("DELETE FROM temp_listings")
+            new_count = 0
+            updated_count = 0
+            price_history_data = []
 
             # Calculate deal scores and prepare data
-            listings_with_scores = []
+            calculate_scores_for_listings(listings)
+            upsert_data = []
             for listing in listings:
-                score, breakdown = calculate_deal_score(listing)
-                listings_with_scores.append((
-                    listing["id"],
+                listing_id = listing["id"]
+                new_price = listing["price"]
+
+                if listing_id in existing_map:
+                    updated_count += 1
+                    if existing_map[listing_id] != new_price:
+                        price_history_data.append((listing_id, new_price, now))
+                else:
+                    new_count += 1
+                    price_history_data.append((listing_id, new_price, now))
+
+                upsert_data.append((
+                    listing_id,
                     listing["title"],
                     listing["url"],
-                    listing["price"],
+                    new_price,
                     listing["price_evaluation"],
                     listing["make"],
                     listing["model"],
@@ -477,119 +588,67 @@ class Storage:
                     listing.get("seller_name"),
                     listing.get("seller_type"),
                     listing.get("thumbnail_url"),
-                    json.dumps(listing.get("badges", [])),
+                    _dumps(listing.get("badges", [])),
+                    listing["deal_score"],
+                    listing["score_breakdown"],
                     listing.get("listing_date"),
-                    score,
-                    json.dumps(breakdown),
+                    now,  # first_seen_at (for new)
+                    now,  # last_seen_at
+                    now,  # created_at (for new)
                 ))
 
-            conn.executemany("""
-                INSERT OR REPLACE INTO temp_listings VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, listings_with_scores)
-
-            # Count existing vs new
-            existing_ids = set(row[0] for row in conn.execute("""
-                SELECT t.id FROM temp_listings t
-                INNER JOIN listings l ON t.id = l.id
-            """).fetchall())
-
-            new_count = len(listings) - len(existing_ids)
-            updated_count = len(existing_ids)
-
-            # Get price changes
-            price_changes = conn.execute("""
-                SELECT t.id, t.price FROM temp_listings t
-                INNER JOIN listings l ON t.id = l.id
-                WHERE t.price != l.price
-            """).fetchall()
-
-            # Update existing
-            conn.execute(f"""
-                UPDATE listings SET
-                    title = (SELECT title FROM temp_listings WHERE temp_listings.id = listings.id),
-                    url = (SELECT url FROM temp_listings WHERE temp_listings.id = listings.id),
-                    price = (SELECT price FROM temp_listings WHERE temp_listings.id = listings.id),
-                    price_evaluation = (SELECT price_evaluation FROM temp_listings WHERE temp_listings.id = listings.id),
-                    make = (SELECT make FROM temp_listings WHERE temp_listings.id = listings.id),
-                    model = (SELECT model FROM temp_listings WHERE temp_listings.id = listings.id),
-                    version = (SELECT version FROM temp_listings WHERE temp_listings.id = listings.id),
-                    year = (SELECT year FROM temp_listings WHERE temp_listings.id = listings.id),
-                    mileage = (SELECT mileage FROM temp_listings WHERE temp_listings.id = listings.id),
-                    fuel_type = (SELECT fuel_type FROM temp_listings WHERE temp_listings.id = listings.id),
-                    gearbox = (SELECT gearbox FROM temp_listings WHERE temp_listings.id = listings.id),
-                    engine_capacity = (SELECT engine_capacity FROM temp_listings WHERE temp_listings.id = listings.id),
-                    engine_power = (SELECT engine_power FROM temp_listings WHERE temp_listings.id = listings.id),
-                    city = (SELECT city FROM temp_listings WHERE temp_listings.id = listings.id),
-                    region = (SELECT region FROM temp_listings WHERE temp_listings.id = listings.id),
-                    seller_name = (SELECT seller_name FROM temp_listings WHERE temp_listings.id = listings.id),
-                    seller_type = (SELECT seller_type FROM temp_listings WHERE temp_listings.id = listings.id),
-                    thumbnail_url = (SELECT thumbnail_url FROM temp_listings WHERE temp_listings.id = listings.id),
-                    badges = (SELECT badges FROM temp_listings WHERE temp_listings.id = listings.id),
-                    listing_date = COALESCE((SELECT listing_date FROM temp_listings WHERE temp_listings.id = listings.id), listings.listing_date),
-                    deal_score = (SELECT deal_score FROM temp_listings WHERE temp_listings.id = listings.id),
-                    score_breakdown = (SELECT score_breakdown FROM temp_listings WHERE temp_listings.id = listings.id),
-                    is_active = 1,
-                    last_seen_at = {now}
-                WHERE id IN (SELECT id FROM temp_listings)
-            """)
-
-            # Insert new
-            conn.execute(f"""
-                INSERT INTO listings (
-                    id, title, url, price, price_evaluation,
-                    make, model, version, year, mileage,
-                    fuel_type, gearbox, engine_capacity, engine_power,
-                    city, region, seller_name, seller_type,
-                    thumbnail_url, badges, deal_score, score_breakdown, is_active,
-                    listing_date, first_seen_at, last_seen_at, created_at
-                )
-                SELECT
-                    t.id, t.title, t.url, t.price, t.price_evaluation,
-                    t.make, t.model, t.version, t.year, t.mileage,
-                    t.fuel_type, t.gearbox, t.engine_capacity, t.engine_power,
-                    t.city, t.region, t.seller_name, t.seller_type,
-                    t.thumbnail_url, t.badges, t.deal_score, t.score_breakdown, 1,
-                    t.listing_date, {now}, {now}, {now}
-                FROM temp_listings t
-                WHERE t.id NOT IN (SELECT id FROM listings)
-            """)
-
-            # Insert price history for new listings
-            conn.execute(f"""
-                INSERT INTO price_history (listing_id, price, recorded_at)
-                SELECT t.id, t.price, {now}
-                FROM temp_listings t
-                WHERE t.id NOT IN (SELECT listing_id FROM price_history)
-            """)
+            conn.executemany(SQLITE_UPSERT_SQL, upsert_data)
 
-            # Insert price history for changed prices
-            if price_changes:
+            if price_history_data:
                 conn.executemany(
-                    f"INSERT INTO price_history (listing_id, price, recorded_at) VALUES (?, ?, {now})",
-                    [(row[0], row[1]) for row in price_changes]
+                    "INSERT INTO price_history (listing_id, price, recorded_at) VALUES (?, ?, ?)",
+                    price_history_data
                 )
 
         return new_count, updated_count
 
     def mark_inactive_not_seen_since(self, timestamp) -> int:
-        """Mark listings not seen since timestamp as inactive"""
+        """
+        Mark listings not seen since timestamp as inactive.
+
+        Works through the stale rows MARK_INACTIVE_BATCH_SIZE at a time,
+        committing after each batch so no single transaction holds the
+        listings table for the whole update.
+        """
+        count = 0
         with self._get_connection() as conn:
             if self.use_postgres:
                 from datetime import datetime
                 if isinstance(timestamp, int):
                     timestamp = datetime.utcfromtimestamp(timestamp)
                 cursor = conn.cursor()
-                cursor.execute(
-                    "UPDATE listings SET is_active = FALSE WHERE last_seen_at < %s AND is_active = TRUE",
-                    (timestamp,)
-                )
-                count = cursor.rowcount
+                while True:
+                    cursor.execute(
+                        """UPDATE listings SET is_active = FALSE WHERE id IN (
+                            SELECT id FROM listings
+                            WHERE last_seen_at < %s AND is_active = TRUE
+                            LIMIT %s
+                        )""",
+                        (timestamp, MARK_INACTIVE_BATCH_SIZE)
+                    )
+                    conn.commit()
+                    count += cursor.rowcount
+                    if cursor.rowcount < MARK_INACTIVE_BATCH_SIZE:
+                        break
             else:
-                result = conn.execute(
-                    "UPDATE listings SET is_active = 0 WHERE last_seen_at < ? AND is_active = 1",
-                    (timestamp,)
-                )
-                count = result.rowcount
+                while True:
+                    result = conn.execute(
+                        """UPDATE listings SET is_active = 0 WHERE id IN (
+                            SELECT id FROM listings
+                            WHERE last_seen_at < ? AND is_active = 1
+                            LIMIT ?
+                        )""",
+                        (timestamp, MARK_INACTIVE_BATCH_SIZE)
+                    )
+                    conn.commit()
+                    count += result.rowcount
+                    if result.rowcount < MARK_INACTIVE_BATCH_SIZE:
+                        break
 
             if count > 0:
                 logger.info(f"Marked {count} listings as inactive/unavailable")
@@ -682,20 +741,25 @@ class Storage:
     def get_stats(self) -> dict:
         """Get database statistics"""
         with self._get_connection() as conn:
+            # One scan of listings for all three counts
             if self.use_postgres:
                 cursor = conn.cursor()
-                cursor.execute("SELECT COUNT(*) FROM listings")
-                total = cursor.fetchone()[0]
-                cursor.execute("SELECT COUNT(*) FROM listings WHERE is_active = TRUE")
-                active = cursor.fetchone()[0]
-                cursor.execute("SELECT COUNT(*) FROM listings WHERE price_evaluation = 'BELOW' AND is_active = TRUE")
-                below_market = cursor.fetchone()[0]
+                cursor.execute("""
+                    SELECT
+                        COUNT(*),
+                        COUNT(*) FILTER (WHERE is_active = TRUE),
+                        COUNT(*) FILTER (WHERE is_active = TRUE AND price_evaluation = 'BELOW')
+                    FROM listings
+                """)
+                total, active, below_market = cursor.fetchone()
             else:
-                total = conn.execute("SELECT COUNT(*) FROM listings").fetchone()[0]
-                active = conn.execute("SELECT COUNT(*) FROM listings WHERE is_active = 1").fetchone()[0]
-                below_market = conn.execute(
-                    "SELECT COUNT(*) FROM listings WHERE price_evaluation = 'BELOW' AND is_active = 1"
-                ).fetchone()[0]
+                total, active, below_market = conn.execute("""
+                    SELECT
+                        COUNT(*),
+                        COUNT(CASE WHEN is_active = 1 THEN 1 END),
+                        COUNT(CASE WHEN is_active = 1 AND price_evaluation = 'BELOW' THEN 1 END)
+                    FROM listings
+                """).fetchone()
 
             return {
                 "total_listings": total,